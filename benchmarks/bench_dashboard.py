@@ -0,0 +1,317 @@
+import argparse
+import gc
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Benchmarks the dashboard against synthetic configurations, logs and lease
+# files in a temporary directory. DNSMASQ and systemctl are never called:
+# the restart/reload helpers and subprocess.run are stubbed out. The memory
+# held by the parsed host store is measured for every size as well.
+#
+#   python benchmarks/bench_dashboard.py --sizes 100,1000,10000 --output before.json
+#   python benchmarks/bench_dashboard.py --compare before.json
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = '100,1000,10000,50000'
+
+
+def host_address(index):
+    mac = ':'.join(f'{b:02x}' for b in (0x02, 0, (index >> 16) & 255, (index >> 8) & 255, index & 255, 0x01))
+    return mac, f'10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255 or 1}'
+
+
+def host_line(index):
+    mac, ip = host_address(index)
+    # Every tenth entry carries the options real configs use.
+    if index % 10 == 0:
+        return f'dhcp-host={mac},set:lab,host-{index:05d},{ip},24h\n'
+    return f'dhcp-host={mac},host-{index:05d},{ip}\n'
+
+
+def write_dnsmasq_conf(path, size):
+    with open(path, 'w') as f:
+        f.write('# synthetic configuration\ninterface=wlan0\n')
+        f.write('dhcp-range=set:lan,10.0.0.2,10.255.255.254,255.0.0.0,12h\n')
+        f.write('address=/ads.example/0.0.0.0\n')
+        for index in range(1, size + 1):
+            f.write(host_line(index))
+
+
+def write_log_file(path, megabytes):
+    # One line in 1000 is a warning naming a host, for the log search.
+    line = json.dumps({'time': '2026-01-01T00:00:00', 'level': 'INFO', 'message': 'x' * 80}) + '\n'
+    with open(path, 'w') as f:
+        for index in range(megabytes * 1024 * 1024 // len(line)):
+            if index % 1000 == 999:
+                mac, ip = host_address(index // 1000 % 50 + 1)
+                f.write(json.dumps({'time': '2026-01-01T00:00:00', 'level': 'WARNING',
+                                    'message': f'DHCPACK {ip} {mac}', 'mac': mac}) + '\n')
+            else:
+                f.write(line)
+
+
+def write_leases_file(path, size):
+    expires = int(time.time()) + 3600
+    with open(path, 'w') as f:
+        for index in range(1, size + 1):
+            mac, ip = host_address(index)
+            f.write(f'{expires} {mac} {ip} lease-{index} *\n')
+
+
+def load_dashboard(workdir, hostsfile, log_level):
+    # The module reads its settings from the environment at import time and
+    # opens its log relative to the working directory.
+    os.environ['DHCP_DASHBOARD_RUN_DIR'] = workdir
+    os.environ['DHCP_DASHBOARD_BACKUP_DIR'] = os.path.join(workdir, 'backups')
+    os.environ['DHCP_DASHBOARD_LEASES'] = os.path.join(workdir, 'dnsmasq.leases')
+    if hostsfile:
+        os.environ['DHCP_DASHBOARD_HOSTSFILE'] = os.path.join(workdir, 'dnsmasq.hosts')
+    if log_level:
+        os.environ['DHCP_DASHBOARD_LOG_LEVEL'] = log_level
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    dashboard = importlib.import_module('dhcp_dashboard')
+
+    def no_op(*args, **kwargs):
+        return None
+
+    def fake_run(args, *a, **kwargs):
+        return subprocess.CompletedProcess(args, 0, stdout='', stderr='')
+
+    dashboard.restart_dnsmasq = no_op
+    dashboard.reload_dnsmasq = no_op
+    dashboard.subprocess.run = fake_run
+    return dashboard
+
+
+def measure(name, size, fn, repeat, setup=None):
+    if setup:
+        setup()
+    fn()
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    result = {
+        'name': name,
+        'size': size,
+        'runs': repeat,
+        'min_ms': timings[0] * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p95_ms': timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000,
+        'ops_per_sec': 1 / statistics.median(timings) if timings[0] > 0 else None,
+    }
+    print(f"{name:<28} {size:>7}  median {result['median_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms",
+          flush=True)
+    return result
+
+
+def resident_bytes():
+    # Resident set size of this process (Linux only).
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def measure_memory(name, size, build):
+    # Memory held by what `build` returns: the bytes still allocated once it
+    # is built (tracemalloc), the peak while building, and how much the
+    # resident set grew. RSS is only indicative, since freed memory from
+    # earlier runs is reused.
+    gc.collect()
+    before = resident_bytes()
+    value = build()
+    gc.collect()
+    after = resident_bytes()
+    del value
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    gc.collect()
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del value
+    result = {
+        'name': name,
+        'size': size,
+        'bytes': allocated,
+        'peak_bytes': peak,
+        'rss_bytes': after - before if before is not None and after is not None else None,
+    }
+    rss = f"{result['rss_bytes'] / 2 ** 20:9.2f} MiB" if result['rss_bytes'] is not None else '      n/a'
+    print(f"{name:<28} {size:>7}  held {allocated / 2 ** 20:9.2f} MiB  peak {peak / 2 ** 20:9.2f} MiB  rss +{rss}",
+          flush=True)
+    return result
+
+
+def expect(response, status):
+    if response.status_code != status:
+        raise RuntimeError(f'{response.request.path}: expected {status}, got {response.status_code}')
+    return response
+
+
+def run_size(dashboard, client, workdir, size, repeat):
+    conf = os.path.join(workdir, f'dnsmasq-{size}.conf')
+    write_dnsmasq_conf(conf, size)
+    write_leases_file(dashboard.DNSMASQ_LEASES, size)
+    dashboard.DNSMASQ_CONF = conf
+    if dashboard.DHCP_HOSTSFILE:
+        if os.path.exists(dashboard.DHCP_HOSTSFILE):
+            os.remove(dashboard.DHCP_HOSTSFILE)
+        dashboard._hostsfile_checked = False
+    dashboard.host_cache.invalidate()
+    dashboard.read_dhcp_hosts()
+
+    def build_store():
+        if dashboard.DHCP_HOSTSFILE:
+            store = dashboard.parse_hostsfile(dashboard.DHCP_HOSTSFILE)
+        else:
+            store = dashboard.parse_dhcp_hosts(conf)
+        # Lookups build any lazy indexes.
+        store.get('00:00:00:00:00:00')
+        return store
+
+    results = [measure_memory('host_store_memory', size, build_store)]
+    results.append(measure('read_dhcp_hosts_cold', size, dashboard.read_dhcp_hosts, repeat,
+                           setup=dashboard.host_cache.invalidate))
+    results.append(measure('read_dhcp_hosts_warm', size, dashboard.read_dhcp_hosts, repeat))
+    results.append(measure('write_dhcp_hosts', size,
+                           lambda: dashboard.write_dhcp_hosts(dashboard.load_host_store()), repeat))
+
+    etag = expect(client.get('/api/hosts'), 200).headers['ETag']
+    results.append(measure('api_get_hosts', size, lambda: expect(client.get('/api/hosts'), 200), repeat))
+    results.append(measure('api_get_hosts_gzip', size,
+                           lambda: expect(client.get('/api/hosts', headers={'Accept-Encoding': 'gzip'}), 200),
+                           repeat))
+    results.append(measure('api_get_hosts_ndjson', size,
+                           lambda: expect(client.get('/api/hosts?format=ndjson'), 200).get_data(), repeat))
+    results.append(measure('api_get_hosts_page', size,
+                           lambda: expect(client.get('/api/hosts?sort=hostname&limit=100'), 200), repeat))
+    results.append(measure('api_get_hosts_not_modified', size,
+                           lambda: expect(client.get('/api/hosts', headers={'If-None-Match': etag}), 304),
+                           repeat))
+
+    # Each add is undone by a delete so every run sees the same host count.
+    new_host = {'mac': '02:ff:ff:ff:ff:01', 'hostname': 'bench-new', 'ip': '10.255.255.1'}
+    results.append(measure('api_add_host', size,
+                           lambda: expect(client.post('/api/hosts', json=new_host), 201), repeat,
+                           setup=lambda: client.delete(f"/api/hosts/{new_host['mac']}")))
+    results.append(measure('api_remove_host', size,
+                           lambda: expect(client.delete(f"/api/hosts/{new_host['mac']}"), 200), repeat,
+                           setup=lambda: client.post('/api/hosts', json=new_host)))
+
+    results.append(measure('api_get_leases', size, lambda: expect(client.get('/api/leases?limit=100'), 200),
+                           repeat))
+    results.append(measure('dashboard', size, lambda: expect(client.get('/'), 200), repeat))
+    results.append(measure('dashboard_search', size, lambda: expect(client.get('/?q=host-0001'), 200), repeat))
+    return results
+
+
+def run_logs(dashboard, client, workdir, megabytes, repeat):
+    dashboard.LOG_FILE = os.path.join(workdir, 'bench.log')
+    write_log_file(dashboard.LOG_FILE, megabytes)
+    size = os.path.getsize(dashboard.LOG_FILE)
+    return [
+        measure('api_get_logs_tail', size, lambda: expect(client.get('/api/logs?lines=100'), 200), repeat),
+        measure('api_get_logs_after', size,
+                lambda: expect(client.get(f'/api/logs?after={size // 2}&lines=1000'), 200), repeat),
+        measure('api_logs_search_mac', size,
+                lambda: expect(client.get(f'/api/logs/search?mac={host_address(1)[0]}'), 200), repeat),
+        measure('api_logs_search_level', size,
+                lambda: expect(client.get('/api/logs/search?level=warning'), 200), repeat),
+        measure('api_logs_search_text', size,
+                lambda: expect(client.get('/api/logs/search?q=nomatch'), 200), repeat),
+        measure('api_download_logs_gzip', size,
+                lambda: expect(client.get('/api/logs/download', headers={'Accept-Encoding': 'gzip'}), 200).get_data(),
+                repeat),
+    ]
+
+
+def compare(results, baseline_path, threshold):
+    # Matches results by (name, size) and reports medians that got slower,
+    # or memory use that grew, by more than `threshold` percent.
+    with open(baseline_path, 'r') as f:
+        baseline = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    regressions = []
+    print(f"\n{'benchmark':<28} {'size':>7} {'baseline':>12} {'current':>12} {'change':>8}")
+    for result in results:
+        before = baseline.get((result['name'], result['size']))
+        if not before:
+            continue
+        if 'bytes' in result:
+            metric, unit, scale = 'bytes', 'MiB', 2 ** 20
+        else:
+            metric, unit, scale = 'median_ms', 'ms', 1
+        change = (result[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0
+        flag = ' !' if change > threshold else ''
+        print(f"{result['name']:<28} {result['size']:>7} {before[metric] / scale:9.3f}{unit:<3} "
+              f"{result[metric] / scale:9.3f}{unit:<3} {change:+7.1f}%{flag}")
+        if change > threshold:
+            regressions.append(result['name'])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the DHCP dashboard')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f'dhcp-host counts (default {DEFAULT_SIZES})')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--log-mb', type=int, default=20, help='size of the synthetic log file')
+    parser.add_argument('--hostsfile', action='store_true', help='use the dhcp-hostsfile backend')
+    parser.add_argument('--log-level', default='WARNING', help='dashboard log level while benchmarking')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=20, help='regression threshold in percent')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='dhcp-dashboard-bench-') as workdir:
+        dashboard = load_dashboard(workdir, args.hostsfile, args.log_level)
+        client = dashboard.app.test_client()
+        results = []
+        for size in sizes:
+            results.extend(run_size(dashboard, client, workdir, size, args.repeat))
+        results.extend(run_logs(dashboard, client, workdir, args.log_mb, args.repeat))
+        os.chdir(cwd)
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'backend': 'hostsfile' if args.hostsfile else 'dnsmasq.conf',
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks are more than {args.threshold:g}% slower")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,205 +1,4535 @@
 import flask
-from flask import Flask, request, render_template_string, flash, redirect, url_for, jsonify, send_file
+from flask import Flask, request, render_template, flash, redirect, url_for, jsonify, send_file, Response, g
 import subprocess
 import re
+import asyncio
+import cProfile
+import csv
+import difflib
+import hashlib
+import hmac
+import io
+import ipaddress
+import json
 import shutil
+import socket
+import sys
+import tempfile
 from datetime import datetime
 import logging
+import logging.handlers
+import marshal
 import os
+import pstats
+import argparse
+import contextvars
+import atexit
+import fcntl
+import glob
+import gzip
+import queue
+import threading
 import time
+import urllib.parse
+import uuid
+import weakref
+import zlib
+from array import array
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timezone
+from itertools import islice
+from json.encoder import encode_basestring_ascii
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Replace with a real secret key
 
+DASHBOARD_PAGE_SIZE = 60
+STATIC_MAX_AGE = 365 * 24 * 3600
+_static_versions = {}
+
+
+def static_url(filename):
+    # Static URLs carry a content hash, so they can be cached indefinitely.
+    version = _static_versions.get(filename)
+    if version is None:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            version = _static_versions[filename] = f'{zlib.crc32(f.read()):08x}'
+    return url_for('static', filename=filename, v=version)
+
+
+app.jinja_env.globals['static_url'] = static_url
+
 DNSMASQ_CONF = '/etc/dnsmasq.conf'
 WPA_SUPPLICANT_CONF = '/etc/wpa_supplicant/wpa_supplicant.conf'
 LOG_FILE = 'dhcp_dashboard.log'
+DNSMASQ_LEASES = os.environ.get('DHCP_DASHBOARD_LEASES', '/var/lib/misc/dnsmasq.leases')
+DNSMASQ_LOG_FILE = os.environ.get('DHCP_DASHBOARD_DNSMASQ_LOG', '/var/log/dnsmasq.log')
+
+# When set, reservations live in this dhcp-hostsfile instead of dhcp-host=
+# lines in DNSMASQ_CONF. dnsmasq re-reads it on SIGHUP, so host changes only
+# need a reload, and single edits are appended/tombstoned in place.
+DHCP_HOSTSFILE = os.environ.get('DHCP_DASHBOARD_HOSTSFILE') or None
+# Removed entries are blanked in place; the hostsfile is compacted once the
+# blanked lines outnumber both this and a quarter of the live entries.
+HOSTSFILE_COMPACT_MIN = 64
+
+# Host changes arriving within RELOAD_DELAY of each other are applied to
+# dnsmasq in one go; RELOAD_MAX_DELAY bounds how long a steady stream of
+# changes can postpone the apply.
+RELOAD_DELAY = float(os.environ.get('DHCP_DASHBOARD_RELOAD_DELAY', '2'))
+RELOAD_MAX_DELAY = float(os.environ.get('DHCP_DASHBOARD_RELOAD_MAX_DELAY', '10'))
+# Shared state between worker processes (reload stamp, lock files).
+RUN_DIR = os.environ.get('DHCP_DASHBOARD_RUN_DIR', tempfile.gettempdir())
+# Monotonic version of the reservation list, bumped by every committed
+# change. Point it at persistent storage to keep it increasing across reboots.
+CONFIG_VERSION_FILE = os.environ.get('DHCP_DASHBOARD_VERSION_FILE',
+                                     os.path.join(RUN_DIR, 'dhcp_dashboard.version'))
+
+# Long-running operations (Wi-Fi changes, restarts, backups) run as
+# background jobs on a small thread pool instead of in the request.
+JOB_WORKERS = int(os.environ.get('DHCP_DASHBOARD_JOB_WORKERS', 2))
+JOB_QUEUE_LIMIT = 20
+JOB_HISTORY = 100
+SUBPROCESS_TIMEOUT = 60
+
+# Configuration backups are stored once per distinct content (gzip blobs
+# named by SHA-256) and pruned to the newest BACKUP_KEEP snapshots, dropping
+# any older than BACKUP_MAX_AGE_DAYS except the newest.
+BACKUP_DIR = os.environ.get('DHCP_DASHBOARD_BACKUP_DIR', '/var/backups/dhcp_dashboard')
+BACKUP_KEEP = int(os.environ.get('DHCP_DASHBOARD_BACKUP_KEEP', 50))
+BACKUP_MAX_AGE_DAYS = float(os.environ.get('DHCP_DASHBOARD_BACKUP_MAX_AGE_DAYS', 90))
+# A backup is made before every host write, so blobs are compressed fast
+# rather than small.
+BACKUP_GZIP_LEVEL = 1
+
+# Each worker process writes its metrics to RUN_DIR this often while they
+# change, and at exit; /metrics adds up the files of all workers.
+METRICS_FLUSH_INTERVAL = float(os.environ.get('DHCP_DASHBOARD_METRICS_FLUSH_INTERVAL', 5))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# The dnsmasq service state is checked on a background thread this often and
+# served from memory by /api/status and the Status button.
+STATUS_INTERVAL = float(os.environ.get('DHCP_DASHBOARD_STATUS_INTERVAL', 10))
+DNSMASQ_STATUS_LOG_LINES = 10
+
+# Host list responses of at least COMPRESS_MIN_SIZE bytes are compressed
+# with gzip, or with brotli when the optional brotli package is installed,
+# for clients that accept it. NDJSON host lists are streamed
+# HOST_STREAM_CHUNK hosts at a time.
+COMPRESS_MIN_SIZE = int(os.environ.get('DHCP_DASHBOARD_COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+HOST_STREAM_CHUNK = 1000
+
+# Request profiling is off unless one of these is set. PROFILE_REQUESTS=1
+# profiles every request; with only PROFILE_TOKEN set, just the requests
+# sending it in the X-Dashboard-Profile header are profiled. The token is
+# also required to download the profiles when set. The PROFILE_KEEP slowest
+# profiles are kept in RUN_DIR.
+PROFILE_REQUESTS = os.environ.get('DHCP_DASHBOARD_PROFILE', '0') == '1'
+PROFILE_TOKEN = os.environ.get('DHCP_DASHBOARD_PROFILE_TOKEN') or None
+PROFILE_KEEP = int(os.environ.get('DHCP_DASHBOARD_PROFILE_KEEP', 20))
+
+# Log records are handed to a queue in the request thread and written by a
+# background listener, which also takes care of rotation and compression.
+LOG_LEVEL = os.environ.get('DHCP_DASHBOARD_LOG_LEVEL', 'DEBUG')
+LOG_FORMAT = os.environ.get('DHCP_DASHBOARD_LOG_FORMAT', 'json')
+LOG_MAX_BYTES = int(os.environ.get('DHCP_DASHBOARD_LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.environ.get('DHCP_DASHBOARD_LOG_ROTATE_WHEN') or None
+LOG_BACKUP_COUNT = int(os.environ.get('DHCP_DASHBOARD_LOG_BACKUP_COUNT', 5))
+LOG_COMPRESS = os.environ.get('DHCP_DASHBOARD_LOG_COMPRESS', '1') == '1'
+
+# /api/logs/search keeps an index of each live log file in RUN_DIR: the
+# lines each MAC address, IP address and hostname appears on, and the time
+# range and levels of every LOG_INDEX_BLOCK bytes. It is extended as the log
+# grows, and searches only read the lines or blocks that can match.
+LOG_INDEX_BLOCK = int(os.environ.get('DHCP_DASHBOARD_LOG_INDEX_BLOCK', 64 * 1024))
+LOG_SEARCH_LIMIT = 1000
+# /api/logs/download reads and compresses logs in chunks of this size.
+LOG_DOWNLOAD_CHUNK = 64 * 1024
+
+
+class JsonLogFormatter(logging.Formatter):
+    EXTRA_FIELDS = ('route', 'method', 'status', 'mac', 'hostname', 'ip', 'latency_ms')
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class SharedFileRotationMixin:
+    # Lets several worker processes write and rotate the same log file:
+    # writes are serialized with an flock, and a process that finds the file
+    # already rotated by another one reopens it instead of rotating again.
+    _lock_file = None
+
+    def emit(self, record):
+        if self._lock_file is None:
+            self._lock_file = open(self.baseFilename + '.lock', 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            if self.stream is not None:
+                try:
+                    rotated = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+                except FileNotFoundError:
+                    rotated = True
+                if rotated:
+                    self.stream.close()
+                    self.stream = self._open()
+                    if hasattr(self, 'rolloverAt'):
+                        self.rolloverAt = self.computeRollover(int(time.time()))
+            super().emit(record)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+
+class SharedRotatingFileHandler(SharedFileRotationMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class SharedTimedRotatingFileHandler(SharedFileRotationMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+def start_log_listener(handler):
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+
+def stop_logging():
+    log_listener.stop()
+
+
+def restart_logging_after_fork():
+    # The listener thread does not survive fork(); forked workers get their
+    # own queue and listener writing through the inherited file handler.
+    global log_listener
+    log_queue_handler.queue, log_listener = start_log_listener(log_listener.handlers[0])
+
+
+def setup_logging():
+    global log_listener, log_queue_handler
+    if LOG_ROTATE_WHEN:
+        handler = SharedTimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT)
+    else:
+        handler = SharedRotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    if LOG_COMPRESS:
+        handler.namer = lambda name: name + '.gz'
+        handler.rotator = gzip_rotator
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    log_queue, log_listener = start_log_listener(handler)
+    log_queue_handler = logging.handlers.QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(log_queue_handler)
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=restart_logging_after_fork)
+
+
+setup_logging()
+
+
+METRICS_HELP = {
+    'dhcp_dashboard_http_requests_total': ('counter', 'HTTP requests by route, method and status.'),
+    'dhcp_dashboard_http_request_duration_seconds': ('histogram', 'HTTP request latency by route.'),
+    'dhcp_dashboard_host_changes_total': ('counter', 'Host reservations added or removed.'),
+    'dhcp_dashboard_host_write_errors_total': ('counter', 'Failed writes of the host reservations.'),
+    'dhcp_dashboard_dnsmasq_actions_total': ('counter', 'DNSMASQ restarts and reloads by result.'),
+    'dhcp_dashboard_dnsmasq_action_duration_seconds': ('histogram', 'Duration of DNSMASQ restarts and reloads.'),
+    'dhcp_dashboard_file_parse_duration_seconds': ('histogram', 'Time spent parsing cached files.'),
+    'dhcp_dashboard_cache_hits_total': ('counter', 'File cache lookups served from memory.'),
+    'dhcp_dashboard_cache_misses_total': ('counter', 'File cache lookups that parsed the file.'),
+    'dhcp_dashboard_hosts': ('gauge', 'Number of host reservations.'),
+    'dhcp_dashboard_dnsmasq_up': ('gauge', 'Whether the dnsmasq service was active at the last check.'),
+    'dhcp_dashboard_log_file_bytes': ('gauge', 'Size of the log files.'),
+}
+
+
+class Metrics:
+    # Counters and histograms for this process, keyed by (name, labels) with
+    # labels as a tuple of (label, value) pairs. Recording is a dict update
+    # under a lock; formatting happens only when /metrics is scraped. A
+    # daemon thread, started on first use in each process, writes changes
+    # out every METRICS_FLUSH_INTERVAL seconds, so idle workers still publish
+    # their last increments; atexit writes the rest.
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._dirty = False
+        self._thread = None
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._dirty = True
+        self._ensure_thread()
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self._buckets) + 1), 0.0, 0]
+            histogram[0][bisect_left(self._buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+            self._dirty = True
+        self._ensure_thread()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(counts), total, count]
+                               for (name, labels), (counts, total, count) in self._histograms.items()],
+            }
+
+    @property
+    def directory(self):
+        return os.path.join(RUN_DIR, 'dhcp_dashboard-metrics')
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own.
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.flush_pending()
+
+    def flush_pending(self):
+        if self._dirty:
+            self.flush()
+
+    def flush(self):
+        # Not fsynced: losing the last few seconds of metrics in a crash is fine.
+        self._dirty = False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{os.getpid()}.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(metrics_snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            logging.error(f"Error saving metrics: {str(e)}")
+
+    def collect(self):
+        # Adds up the snapshots of every worker, this one included. Files of
+        # workers that have exited are folded into retired.json, so counters
+        # do not go backwards when gunicorn replaces a worker.
+        self.flush()
+        totals = ({}, {})
+        with open(os.path.join(self.directory, 'metrics.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            retired_path = os.path.join(self.directory, 'retired.json')
+            retired = ({}, {})
+            self._merge(retired, self._read(retired_path))
+            exited = []
+            for name in os.listdir(self.directory):
+                if not name[:1].isdigit() or not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    os.kill(int(name[:-len('.json')]), 0)
+                except ProcessLookupError:
+                    self._merge(retired, self._read(path))
+                    exited.append(path)
+                    continue
+                except (ValueError, PermissionError):
+                    pass
+                self._merge(totals, self._read(path))
+            if exited:
+                with open(retired_path + '.tmp', 'w') as f:
+                    json.dump(self._as_snapshot(retired), f)
+                os.replace(retired_path + '.tmp', retired_path)
+                for path in exited:
+                    os.remove(path)
+        self._merge(totals, self._as_snapshot(retired))
+        return totals
+
+    @staticmethod
+    def _as_snapshot(totals):
+        counters, histograms = totals
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels)] + histogram for (name, labels), histogram in histograms.items()],
+        }
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _merge(totals, snapshot):
+        counters, histograms = totals
+        for metric, labels, value in snapshot.get('counters', ()):
+            key = (metric, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for metric, labels, counts, total, count in snapshot.get('histograms', ()):
+            key = (metric, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+
+
+metrics = Metrics(LATENCY_BUCKETS)
+atexit.register(metrics.flush_pending)
+
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_metrics(counters, histograms, gauges):
+    lines = []
+    samples = {}
+    for (name, labels), value in counters.items():
+        samples.setdefault(name, []).append(f'{name}{format_metric_labels(labels)} {value}')
+    for (name, labels), value in gauges.items():
+        samples.setdefault(name, []).append(f'{name}{format_metric_labels(labels)} {value}')
+    for (name, labels), (counts, total, count) in histograms.items():
+        series = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+            cumulative += bucket
+            series.append(f'{name}_bucket{format_metric_labels(labels + (("le", bound),))} {cumulative}')
+        series.append(f'{name}_sum{format_metric_labels(labels)} {total}')
+        series.append(f'{name}_count{format_metric_labels(labels)} {count}')
+    for name in sorted(samples):
+        kind, description = METRICS_HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples[name])
+    return '\n'.join(lines) + '\n'
+
+
+Host = namedtuple('Host', ['mac', 'hostname', 'ip'])
+
+
+def normalize_mac(mac):
+    return mac.strip().lower().replace('-', ':')
+
+
+class HostConflictError(Exception):
+    def __init__(self, field, value):
+        super().__init__(f"{field} {value} already exists")
+        self.field = field
+        self.value = value
+
+
+def pack_mac(mac):
+    # The address as a 48-bit integer, or None for forms that do not pack
+    # (wildcards, hardware-type prefixes).
+    key = normalize_mac(mac)
+    return int(key.replace(':', ''), 16) if MAC_RE.match(key) else None
+
+
+def pack_ipv4(ip):
+    # The address as a 32-bit integer, or None unless `ip` is exactly how the
+    # packed value prints, so a host always reads back as it was written.
+    try:
+        packed = socket.inet_aton(ip)
+    except (OSError, TypeError):
+        return None
+    value = int.from_bytes(packed, 'big')
+    return value if value and socket.inet_ntoa(packed) == ip else None
+
+
+IPV4_OCTETS = [str(octet) for octet in range(256)]
+_ipv4_prefixes = {}
+
+
+def format_ipv4(value):
+    # Hosts share a handful of /24 prefixes, so only the last octet is
+    # formatted per address.
+    prefix = _ipv4_prefixes.get(value >> 8)
+    if prefix is None:
+        if len(_ipv4_prefixes) > 4096:
+            _ipv4_prefixes.clear()
+        prefix = _ipv4_prefixes[value >> 8] = socket.inet_ntoa(value.to_bytes(4, 'big')).rpartition('.')[0] + '.'
+    return prefix + IPV4_OCTETS[value & 255]
+
+
+def line_crc(text):
+    return zlib.crc32(text.encode())
+
+
+class HostView:
+    # Read-only sequence over rows of a HostStore. Hosts are built as they
+    # are read; slicing, filtering and sorting return views over row numbers,
+    # so a sorted page of a large store only creates the hosts on that page.
+    def __init__(self, store, rows):
+        self._store = store
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return HostView(self._store, self._rows[index])
+        return self._store._host(self._rows[index])
+
+    def __iter__(self):
+        host = self._store._host
+        for row in self._rows:
+            yield host(row)
+
+    def filter(self, mac='', hostname='', ip='', q=''):
+        # Same matching as filter_hosts (arguments already lowercased). A
+        # search term that cannot occur in a packed MAC or IPv4 address skips
+        # formatting them.
+        store = self._store
+        names = store._names
+        flags = store._flags
+        rows = self._rows
+        if hostname:
+            rows = [row for row in rows if names[row].lower().startswith(hostname)]
+        if mac:
+            rows = [row for row in rows if store._mac(row).lower().startswith(mac)]
+        if ip:
+            rows = [row for row in rows if store._ip(row).startswith(ip)]
+        if q:
+            in_macs = not q.strip('0123456789abcdef:')
+            in_ips = not q.strip('0123456789.')
+            rows = [row for row in rows
+                    if q in names[row].lower()
+                    or (in_macs or flags[row] & store.MAC_TEXT) and q in store._mac(row).lower()
+                    or (in_ips or flags[row] & store.IP_TEXT) and q in store._ip(row)]
+        return HostView(store, array('L', rows))
+
+    def json_objects(self):
+        # Each host as the JSON object jsonify() makes of host_to_dict(),
+        # written straight from the columns.
+        store = self._store
+        names, macs, ips, flags = store._names, store._macs, store._ips, store._flags
+        text = store.MAC_TEXT | store.MAC_UPPER | store.IP_TEXT
+        for row in self._rows:
+            if flags[row] & text:
+                yield json.dumps(host_to_dict(store._host(row)), separators=(',', ':'), sort_keys=True)
+                continue
+            ip = ips[row]
+            yield (f'{{"hostname":{encode_basestring_ascii(names[row])},"ip":"{format_ipv4(ip) if ip else ""}",'
+                   f'"mac":"{macs[row].to_bytes(6, "big").hex(":")}"}}')
+
+    def to_json(self):
+        return '[' + ','.join(self.json_objects()) + ']\n'
+
+    def ndjson_chunks(self, size=HOST_STREAM_CHUNK):
+        # The hosts as NDJSON, `size` lines per chunk.
+        objects = self.json_objects()
+        while True:
+            lines = list(islice(objects, size))
+            if not lines:
+                return
+            yield ('\n'.join(lines) + '\n').encode()
+
+    def sorted(self, field, descending=False):
+        # Same order as sorting the hosts by host_sort_key(field), using the
+        # packed columns unless a row keeps its MAC or IP as text.
+        store = self._store
+        macs = store._macs
+        mask = store.MAC_TEXT | store.MAC_UPPER | store.IP_TEXT
+        if any(store._flags[row] & mask for row in self._rows):
+            key = host_sort_key(field)
+            rows = sorted(self._rows, key=lambda row: key(store._host(row)), reverse=descending)
+        elif field == 'mac':
+            rows = sorted(self._rows, key=macs.__getitem__, reverse=descending)
+        elif field == 'ip':
+            ips = store._ips
+            rows = sorted(self._rows, key=lambda row: (ips[row], macs[row]), reverse=descending)
+        else:
+            names = store._names
+            rows = sorted(self._rows, key=lambda row: (names[row].lower(), macs[row]), reverse=descending)
+        return HostView(store, array('L', rows))
+
+
+class HostStore:
+    # Reservations in array-backed columns, one row per host in on-disk
+    # order: MACs packed into 48 bits, IPv4 addresses into 32 bits and
+    # interned hostnames. MACs, which every add, edit and remove looks up,
+    # are indexed by a dict. The hostname and IP indexes, only used for
+    # conflict checks and lookups, are arrays of row numbers sorted by the
+    # column: 4 bytes per host, but an insert or delete moves the rows after
+    # it (a memmove of up to 80 KB at 20k hosts). All are built on first
+    # use. Removed rows stay in place until the file is read again, so their
+    # lines can be dropped.
+    LIVE = 1
+    DIRTY = 2
+    MAC_UPPER = 4
+    MAC_TEXT = 8
+    MAC_UNPACKED = 16
+    IP_TEXT = 32
+
+    def __init__(self, hosts=()):
+        self._macs = array('Q')
+        self._ips = array('L')
+        self._names = []
+        self._flags = bytearray()
+        # Where each row's line is: index into self.paths, line number (0
+        # when not written yet), CRC-32 of its text and, for the hostsfile,
+        # its byte offset.
+        self._paths = array('H')
+        self._lines = array('L')
+        self._crcs = array('L')
+        self._offsets = array('q')
+        self.paths = []
+        # Values that do not pack, by row.
+        self._mac_text = {}
+        self._ip_text = {}
+        # The parsed dhcp-host entry of rows whose line has more than the
+        # MAC, hostname and IP (tags, client ids, lease times, a comment, a
+        # different field order), so an edit keeps it.
+        self._entries = {}
+        self._count = 0
+        self._live_rows = None
+        self._ip_index = self._name_index = None
+        # Packed MAC, or the normalized text of MACs that do not pack -> row.
+        self._mac_rows = {}
+        self._text_ips = {}
+        # The MAC index while the store is read, before the others are built.
+        self._loading = {}
+        # Normalized MAC -> row for hosts removed or renamed since the read.
+        self._removed = {}
+        # (path, line) -> CRC-32 of managed lines that hold no host
+        # (blanked hostsfile lines); the next rewrite drops them.
+        self.sources = {}
+        self.tombstones = 0
+        self.line_count = 0
+        # path -> stat signature of every file the store was read from.
+        self.dependencies = {}
+        for host in hosts:
+            self.load(host)
+
+    def load(self, host):
+        host = self._make(host)
+        if self._loading is None and self._row(host.mac) is not None:
+            logging.warning(f"Ignoring duplicate dhcp-host entry for MAC {host.mac}")
+            return None
+        row = self._append(host)
+        if self._loading is None:
+            self._index(row)
+            return host
+        key = self._mac_key(row)
+        if key in self._loading:
+            self._pop()
+            logging.warning(f"Ignoring duplicate dhcp-host entry for MAC {host.mac}")
+            return None
+        self._loading[key] = row
+        return host
+
+    def load_entry(self, entry, offset=-1):
+        # Entries without a MAC address, or repeating one, are left on disk
+        # untouched but are not managed by the store.
+        if not entry.macs:
+            return None
+        host = self.load(entry_to_host(entry))
+        if host:
+            row = len(self._names) - 1
+            self._set_line(row, entry.source.path, entry.source.line, line_crc(entry.source.text), offset)
+            self._set_entry(row, host, entry)
+        return host
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __contains__(self, mac):
+        return self._row(mac) is not None
+
+    def view(self):
+        if self._live_rows is None:
+            if self._count == len(self._names):
+                self._live_rows = range(self._count)
+            else:
+                self._live_rows = array('L', (row for row, flags in enumerate(self._flags) if flags & self.LIVE))
+        return HostView(self, self._live_rows)
+
+    def get(self, mac):
+        row = self._row(mac)
+        return self._host(row) if row is not None else None
+
+    def entry(self, mac):
+        row = self._row(mac)
+        return self._entries.get(row) if row is not None else None
+
+    def find_by_hostname(self, hostname):
+        rows = self._name_rows(hostname)
+        return self._host(rows[0]) if rows else None
+
+    def find_by_ip(self, ip):
+        rows = self._ip_rows(ip)
+        return self._host(rows[0]) if rows else None
+
+    def conflict(self, mac, hostname, ip, ignore_mac=None):
+        ignore = self._row(ignore_mac) if ignore_mac else None
+        row = self._row(mac)
+        if row is not None and row != ignore:
+            return 'mac'
+        if hostname and any(row != ignore for row in self._name_rows(hostname)):
+            return 'hostname'
+        if ip and any(row != ignore for row in self._ip_rows(ip)):
+            return 'ip'
+        return None
+
+    def add(self, host):
+        host = self._make(host)
+        field = self.conflict(host.mac, host.hostname, host.ip)
+        if field:
+            raise HostConflictError(field, getattr(host, field))
+        row = self._append(host)
+        self._flags[row] |= self.DIRTY
+        self._index(row)
+        return host
+
+    def replace(self, old_mac, host):
+        # Keeps the row, and with it the line the host is written on.
+        host = self._make(host)
+        field = self.conflict(host.mac, host.hostname, host.ip, ignore_mac=old_mac)
+        if field:
+            raise HostConflictError(field, getattr(host, field))
+        row = self._row(old_mac)
+        if row is None:
+            return self.add(host)
+        if self._host(row) != host:
+            self._unindex(row)
+            if normalize_mac(old_mac) != normalize_mac(host.mac):
+                self._removed[normalize_mac(old_mac)] = row
+            self._set(row, host)
+            self._flags[row] |= self.DIRTY
+            self._index(row)
+        return host
+
+    def remove(self, mac):
+        row = self._row(mac)
+        if row is None:
+            return None
+        host = self._host(row)
+        self._unindex(row)
+        self._flags[row] &= ~self.LIVE
+        self._entries.pop(row, None)
+        self._removed[normalize_mac(mac)] = row
+        self._count -= 1
+        self._live_rows = None
+        return host
+
+    def assign(self, hosts):
+        # Makes the store hold exactly `hosts` (in that order for new ones),
+        # keeping the lines of the hosts that stay.
+        wanted = {}
+        for host in hosts:
+            host = self._make(host)
+            wanted.setdefault(normalize_mac(host.mac), host)
+        for row in list(self.view()._rows):
+            host = self._host(row)
+            new = wanted.pop(normalize_mac(host.mac), None)
+            if new is None:
+                self.remove(host.mac)
+            elif new != host:
+                self._unindex(row)
+                self._set(row, new)
+                self._flags[row] |= self.DIRTY
+                self._index(row)
+        for host in wanted.values():
+            row = self._append(host)
+            self._flags[row] |= self.DIRTY
+            self._index(row)
+
+    def lines(self):
+        # (row, path, line, crc, host, entry, changed) for every line the
+        # store manages; host is None for lines to drop, row None for lines
+        # that hold no host.
+        for row, number in enumerate(self._lines):
+            if not number:
+                continue
+            path = self.paths[self._paths[row]]
+            flags = self._flags[row]
+            if flags & self.LIVE:
+                yield (row, path, number, self._crcs[row], self._host(row), self._entries.get(row),
+                       bool(flags & self.DIRTY))
+            else:
+                yield row, path, number, self._crcs[row], None, None, True
+        for (path, number), crc in self.sources.items():
+            yield None, path, number, crc, None, None, True
+
+    def unplaced(self):
+        # Live hosts that have no line yet, with their rows and entries.
+        for row in self.view()._rows:
+            if not self._lines[row]:
+                yield row, self._host(row), self._entries.get(row)
+
+    def rewritten(self, path, placed):
+        # Records where the store's lines in `path` are after a rewrite:
+        # `placed` maps each row kept or written to (line, byte offset, text,
+        # fields), fields being None for lines kept as they were. The
+        # store's other lines in the file were dropped.
+        path_id = self.paths.index(path) if path in self.paths else None
+        for row, number in enumerate(self._lines):
+            if number and self._paths[row] == path_id and row not in placed:
+                self._lines[row] = 0
+                self._offsets[row] = -1
+        for row, (number, offset, text, fields) in placed.items():
+            self._set_line(row, path, number, line_crc(text), offset)
+            if fields is not None:
+                self._flags[row] &= ~self.DIRTY
+                self._set_entry(row, self._host(row), parse_host_fields(fields))
+        for key in [key for key in self.sources if key[0] == path]:
+            del self.sources[key]
+            self.tombstones -= 1
+        self._removed = {mac: row for mac, row in self._removed.items() if self._lines[row]}
+
+    def _released_row(self, mac):
+        row = self._removed.get(normalize_mac(mac))
+        return row if row is not None else self._row(mac)
+
+    def released_line(self, mac):
+        # The byte offset (None if unknown) and line number of the line a
+        # removed, renamed or replaced host was written on.
+        row = self._released_row(mac)
+        if row is None or not self._lines[row]:
+            return None, None
+        offset = self._offsets[row]
+        return (offset if offset >= 0 else None), self._lines[row]
+
+    def release_line(self, mac):
+        # Detaches that line once it no longer holds the host.
+        row = self._released_row(mac)
+        self._removed.pop(normalize_mac(mac), None)
+        if row is not None:
+            self._lines[row] = 0
+            self._offsets[row] = -1
+
+    def place(self, mac, path, number, text, offset=-1):
+        # Records the line a host has just been written to.
+        row = self._row(mac)
+        self._set_line(row, path, number, line_crc(text), offset)
+        self._flags[row] &= ~self.DIRTY
+        self._set_entry(row, self._host(row), parse_host_fields(text.strip()))
+
+    def extend_line(self, path, number, suffix):
+        if (path, number) in self.sources:
+            self.sources[(path, number)] = zlib.crc32(suffix.encode(), self.sources[(path, number)])
+            return
+        path_id = self.paths.index(path) if path in self.paths else None
+        for row, line in enumerate(self._lines):
+            if line == number and self._paths[row] == path_id:
+                self._crcs[row] = zlib.crc32(suffix.encode(), self._crcs[row])
+
+    @staticmethod
+    def _make(host):
+        mac, hostname, ip = host
+        return Host(mac, hostname, ip or '')
+
+    def _host(self, row):
+        flags = self._flags[row]
+        if flags & self.MAC_TEXT:
+            mac = self._mac_text[row]
+        else:
+            mac = self._macs[row].to_bytes(6, 'big').hex(':')
+            if flags & self.MAC_UPPER:
+                mac = mac.upper()
+        if flags & self.IP_TEXT:
+            ip = self._ip_text[row]
+        else:
+            ip = self._ips[row]
+            ip = format_ipv4(ip) if ip else ''
+        # tuple.__new__ skips the argument handling of Host(); this runs for
+        # every host a view yields.
+        return tuple.__new__(Host, (mac, self._names[row], ip))
+
+    def _mac(self, row):
+        flags = self._flags[row]
+        if flags & self.MAC_TEXT:
+            return self._mac_text[row]
+        mac = self._macs[row].to_bytes(6, 'big').hex(':')
+        return mac.upper() if flags & self.MAC_UPPER else mac
+
+    def _ip(self, row):
+        if self._flags[row] & self.IP_TEXT:
+            return self._ip_text[row]
+        ip = self._ips[row]
+        return format_ipv4(ip) if ip else ''
+
+    def _append(self, host):
+        row = len(self._names)
+        mac, ip, flags = self._pack(row, host)
+        self._macs.append(mac)
+        self._ips.append(ip)
+        self._names.append(sys.intern(host.hostname))
+        self._flags.append(self.LIVE | flags)
+        self._paths.append(0)
+        self._lines.append(0)
+        self._crcs.append(0)
+        self._offsets.append(-1)
+        self._count += 1
+        self._live_rows = None
+        return row
+
+    def _pop(self):
+        # Drops the row just appended.
+        row = len(self._names) - 1
+        for column in (self._macs, self._ips, self._names, self._flags, self._paths, self._lines, self._crcs,
+                       self._offsets):
+            del column[row]
+        self._mac_text.pop(row, None)
+        self._ip_text.pop(row, None)
+        self._count -= 1
+        self._live_rows = None
+
+    def _set(self, row, host):
+        self._mac_text.pop(row, None)
+        self._ip_text.pop(row, None)
+        self._macs[row], self._ips[row], flags = self._pack(row, host)
+        self._names[row] = sys.intern(host.hostname)
+        self._flags[row] = self._flags[row] & (self.LIVE | self.DIRTY) | flags
+
+    def _pack(self, row, host):
+        # Packed MAC and IP of `host` and the flags saying how they print;
+        # values that do not pack are kept as text for `row`.
+        flags = 0
+        key = normalize_mac(host.mac)
+        if MAC_RE.match(key):
+            mac = int(key.replace(':', ''), 16)
+            if host.mac != key:
+                if host.mac == key.upper():
+                    flags |= self.MAC_UPPER
+                else:
+                    flags |= self.MAC_TEXT
+                    self._mac_text[row] = host.mac
+        else:
+            mac = 0
+            flags |= self.MAC_TEXT | self.MAC_UNPACKED
+            self._mac_text[row] = host.mac
+        ip = pack_ipv4(host.ip) if host.ip else 0
+        if ip is None:
+            ip = 0
+            flags |= self.IP_TEXT
+            self._ip_text[row] = host.ip
+        return mac, ip, flags
+
+    def _set_line(self, row, path, number, crc, offset):
+        if path not in self.paths:
+            self.paths.append(path)
+        self._paths[row] = self.paths.index(path)
+        self._lines[row] = number
+        self._crcs[row] = crc
+        self._offsets[row] = offset
+
+    def _set_entry(self, row, host, entry):
+        plain = len(entry.macs) == 1 and not (entry.client_id or entry.tags or entry.set_tags or entry.ipv6
+                                              or entry.lease_time or entry.ignore or entry.comment)
+        if plain and ','.join(entry.tokens) == format_host_entry(*host):
+            self._entries.pop(row, None)
+        else:
+            self._entries[row] = entry._replace(source=None)
+
+    def _mac_key(self, row):
+        if self._flags[row] & self.MAC_UNPACKED:
+            return normalize_mac(self._mac_text[row])
+        return self._macs[row]
+
+    def _ip_key(self, row):
+        return self._ips[row]
+
+    def _name_key(self, row):
+        return self._names[row].lower()
+
+    def _build_indexes(self):
+        rows = self.view()._rows
+        self._mac_rows = self._loading
+        self._ip_index = array('L', sorted((row for row in rows if self._ips[row]), key=self._ip_key))
+        self._name_index = array('L', sorted((row for row in rows if self._names[row]), key=self._name_key))
+        self._text_ips = {}
+        for row in rows:
+            if self._flags[row] & self.IP_TEXT:
+                self._text_ips.setdefault(self._ip_text[row], []).append(row)
+        self._loading = None
+
+    def _rows_equal(self, index, value, key):
+        # Rows of a sorted index whose key equals `value`.
+        start = bisect_left(index, value, key=key)
+        end = bisect_right(index, value, lo=start, key=key)
+        return index[start:end]
+
+    def _row(self, mac):
+        if self._loading is not None:
+            self._build_indexes()
+        if not mac:
+            return None
+        packed = pack_mac(mac)
+        return self._mac_rows.get(normalize_mac(mac) if packed is None else packed)
+
+    def _name_rows(self, hostname):
+        if self._loading is not None:
+            self._build_indexes()
+        return self._rows_equal(self._name_index, hostname.lower(), self._name_key) if hostname else []
+
+    def _ip_rows(self, ip):
+        if self._loading is not None:
+            self._build_indexes()
+        if not ip:
+            return []
+        packed = pack_ipv4(ip)
+        if packed is None:
+            return self._text_ips.get(ip, [])
+        return self._rows_equal(self._ip_index, packed, self._ip_key)
+
+    def _index(self, row):
+        if self._loading is not None:
+            self._build_indexes()
+            return
+        flags = self._flags[row]
+        self._mac_rows.setdefault(self._mac_key(row), row)
+        if flags & self.IP_TEXT:
+            self._text_ips.setdefault(self._ip_text[row], []).append(row)
+        elif self._ips[row]:
+            self._ip_index.insert(bisect_right(self._ip_index, self._ips[row], key=self._ip_key), row)
+        if self._names[row]:
+            self._name_index.insert(bisect_right(self._name_index, self._name_key(row), key=self._name_key), row)
+
+    def _unindex(self, row):
+        if self._loading is not None:
+            self._build_indexes()
+        flags = self._flags[row]
+        key = self._mac_key(row)
+        if self._mac_rows.get(key) == row:
+            del self._mac_rows[key]
+        if flags & self.IP_TEXT:
+            rows = self._text_ips.get(self._ip_text[row], [])
+            if row in rows:
+                rows.remove(row)
+                if not rows:
+                    del self._text_ips[self._ip_text[row]]
+        elif self._ips[row]:
+            self._drop(self._ip_index, self._ips[row], self._ip_key, row)
+        if self._names[row]:
+            self._drop(self._name_index, self._name_key(row), self._name_key, row)
+
+    @staticmethod
+    def _drop(index, value, key, row):
+        start = bisect_left(index, value, key=key)
+        end = bisect_right(index, value, lo=start, key=key)
+        for position in range(start, end):
+            if index[position] == row:
+                del index[position]
+                return
+
+
+class FileCache:
+    # A parsed view of one file, revalidated against the file's stat
+    # signature so it is only re-read when it actually changes on disk.
+    # Values read from several files (includes) list them, with their
+    # signatures, in a `dependencies` dict that is revalidated as well.
+    def __init__(self, name=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self._signature = None
+        self._value = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def signature(path):
+        st = os.stat(path)
+        return (path, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def lookup(self, path, parse):
+        signature = self.signature(path)
+        with self._lock:
+            if self._value is not None and signature == self._signature and self._dependencies_unchanged(path):
+                self.hits += 1
+                return self._value, signature
+            self.misses += 1
+        # Stat is taken before reading, so a change during the read shows up
+        # as a mismatch on the next lookup instead of being cached as current.
+        started = time.perf_counter()
+        value = parse(path)
+        if self.name:
+            metrics.observe('dhcp_dashboard_file_parse_duration_seconds', time.perf_counter() - started,
+                            (('cache', self.name),))
+        with self._lock:
+            self._signature = signature
+            self._value = value
+        return value, signature
+
+    def _dependencies_unchanged(self, path):
+        for dependency, signature in getattr(self._value, 'dependencies', {}).items():
+            if dependency == path:
+                continue
+            try:
+                if self.signature(dependency) != signature:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def get(self, path, parse):
+        return self.lookup(path, parse)[0]
+
+    def peek(self):
+        with self._lock:
+            return self._value
+
+    def put(self, path, value):
+        signature = self.signature(path)
+        with self._lock:
+            self._signature = signature
+            self._value = value
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+            self._value = None
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._value) if self._value is not None else None,
+                'path': self._signature[0] if self._signature else None,
+            }
+
+
+host_cache = FileCache('hosts')
+host_lock = threading.RLock()
+
+CONFLICT_MESSAGES = {
+    'mac': 'MAC address already exists',
+    'hostname': 'Hostname already exists',
+    'ip': 'IP address already reserved',
+}
+
+MAC_RE = re.compile(r'^[0-9a-f]{2}(:[0-9a-f]{2}){5}$')
+HOSTNAME_RE = re.compile(r'^[A-Za-z0-9_.-]{1,253}$')
+
+
+def validate_host(mac, hostname, ip):
+    if not isinstance(mac, str) or not MAC_RE.match(normalize_mac(mac)):
+        return 'Invalid MAC address'
+    if not isinstance(hostname, str) or not HOSTNAME_RE.match(hostname):
+        return 'Invalid hostname'
+    if ip:
+        if not isinstance(ip, str):
+            return 'Invalid IP address'
+        try:
+            ipaddress.IPv4Address(ip)
+        except ValueError:
+            return 'Invalid IP address'
+    return None
+
+
+def format_host_entry(mac, hostname, ip):
+    return f'{mac},{hostname},{ip}' if ip else f'{mac},{hostname}'
+
+
+# Typed model of a dnsmasq configuration. Every entry records the file,
+# line number and original text it was parsed from.
+ConfigSource = namedtuple('ConfigSource', ['path', 'line', 'text'])
+DhcpHost = namedtuple('DhcpHost', ['macs', 'client_id', 'tags', 'set_tags', 'ip', 'ipv6', 'hostname',
+                                   'lease_time', 'ignore', 'tokens', 'comment', 'source'])
+DhcpRange = namedtuple('DhcpRange', ['tags', 'set_tags', 'start', 'end', 'netmask', 'modes', 'lease_time',
+                                     'source'])
+AddressRecord = namedtuple('AddressRecord', ['domains', 'ip', 'source'])
+HostRecord = namedtuple('HostRecord', ['names', 'addresses', 'ttl', 'source'])
+ConfigInclude = namedtuple('ConfigInclude', ['kind', 'path', 'source'])
+ConfigOption = namedtuple('ConfigOption', ['key', 'value', 'source'])
+
+CONFIG_MAC_RE = re.compile(r'^(?:[0-9a-fA-F]{1,2}-)?[0-9a-fA-F*]{1,2}(?::[0-9a-fA-F*]{1,2})+$'
+                           r'|^[0-9a-fA-F]{2}(?:-[0-9a-fA-F]{2}){5}$')
+IPV4_RE = re.compile(r'^\d{1,3}(?:\.\d{1,3}){3}$')
+LEASE_TIME_RE = re.compile(r'^(?:\d+[smhdw]?|infinite)$', re.IGNORECASE)
+CONFIG_COMMENT_RE = re.compile(r'\s+#.*$')
+# The mac,name[,ip] lines the dashboard writes itself, read without
+# classifying each field. A name that reads as an address, a lease time or
+# "ignore" is not a name, so such lines take the general path.
+PLAIN_HOST_RE = re.compile(r'^([0-9a-f]{2}(?::[0-9a-f]{2}){5}),'
+                           r'(?!(?:\d{1,3}(?:\.\d{1,3}){3}|\d+[smhdw]?|infinite|ignore)(?:,|$))([a-z0-9_.-]+)'
+                           r'(?:,(\d{1,3}(?:\.\d{1,3}){3}))?$', re.IGNORECASE)
+
+
+def split_comment(text):
+    # The text before a trailing comment, and the comment with the
+    # whitespace in front of it ('' if there is none).
+    match = CONFIG_COMMENT_RE.search(text)
+    return (text[:match.start()], match.group().rstrip()) if match else (text, '')
+
+
+def split_tags(tokens):
+    tags, set_tags, rest = [], [], []
+    for token in tokens:
+        prefix = token[:4].lower()
+        if prefix == 'tag:':
+            tags.append(token[4:])
+        elif prefix in ('set:', 'net:'):
+            set_tags.append(token[4:])
+        else:
+            rest.append(token)
+    return tuple(tags), tuple(set_tags), rest
+
+
+def parse_host_fields(value, source=None):
+    # dhcp-host fields may come in any order; like dnsmasq, each one is
+    # classified by its form. A trailing comment, in `value` or in the line
+    # it was read from, is kept for when the line is written again.
+    comment = ''
+    if '#' in value:
+        value, comment = split_comment(value)
+    elif source is not None and '#' in source.text:
+        comment = split_comment(source.text)[1]
+    plain = PLAIN_HOST_RE.match(value)
+    if plain:
+        mac, hostname, ip = plain.groups()
+        return DhcpHost((mac,), None, (), (), ip, (), hostname, None, False, tuple(value.split(',')), comment,
+                        source)
+    tokens = tuple(token.strip() for token in value.split(','))
+    tags, set_tags, rest = split_tags(tokens)
+    macs, ipv6 = [], []
+    client_id = ip = hostname = lease_time = None
+    ignore = False
+    for token in rest:
+        if token[:3].lower() == 'id:':
+            client_id = token[3:]
+        elif token.lower() == 'ignore':
+            ignore = True
+        elif token.startswith('[') and token.endswith(']'):
+            ipv6.append(token[1:-1])
+        elif CONFIG_MAC_RE.match(token):
+            macs.append(token)
+        elif ip is None and IPV4_RE.match(token):
+            ip = token
+        elif lease_time is None and LEASE_TIME_RE.match(token):
+            lease_time = token
+        elif hostname is None and token:
+            hostname = token
+    return DhcpHost(tuple(macs), client_id, tags, set_tags, ip, tuple(ipv6), hostname, lease_time, ignore,
+                    tokens, comment, source)
+
+
+def is_ip_address(token):
+    try:
+        ipaddress.ip_address(token)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_dhcp_range(value, source=None):
+    # [tag:<tag>,][set:<tag>,]<start>[,<end>|<mode>][,<netmask>[,<broadcast>]][,<lease time>]
+    tags, set_tags, rest = split_tags(token.strip() for token in value.split(','))
+    start = rest.pop(0) if rest else None
+    lease_time = None
+    # A bare number after an IPv6 range is its prefix length, not a lease time.
+    if rest and LEASE_TIME_RE.match(rest[-1]) and not (':' in (start or '') and rest[-1].isdigit()
+                                                       and int(rest[-1]) <= 128):
+        lease_time = rest.pop()
+    addresses = [token for token in rest if is_ip_address(token)]
+    end = addresses[0] if addresses else None
+    netmask = addresses[1] if len(addresses) > 1 else None
+    modes = tuple(token for token in rest if token not in (end, netmask))
+    return DhcpRange(tags, set_tags, start, end, netmask, modes, lease_time, source)
+
+
+def parse_address(value, source=None):
+    # address=/example.com/other.example/10.0.0.1 (an empty address answers NXDOMAIN)
+    parts = value.split('/')
+    ip = (parts[-1] or None) if len(parts) > 2 else None
+    return AddressRecord(tuple(part for part in parts[1:-1] if part), ip, source)
+
+
+def parse_host_record(value, source=None):
+    names, addresses = [], []
+    ttl = None
+    for token in (token.strip() for token in value.split(',')):
+        if is_ip_address(token):
+            addresses.append(token)
+        elif token.isdigit():
+            ttl = int(token)
+        elif token:
+            names.append(token)
+    return HostRecord(tuple(names), tuple(addresses), ttl, source)
+
+
+CONFIG_PARSERS = {
+    'dhcp-host': ('hosts', parse_host_fields),
+    'dhcp-range': ('ranges', parse_dhcp_range),
+    'address': ('addresses', parse_address),
+    'host-record': ('host_records', parse_host_record),
+}
+
+
+class DnsmasqConfig:
+    def __init__(self):
+        self.hosts = []
+        self.ranges = []
+        self.addresses = []
+        self.host_records = []
+        self.includes = []
+        self.options = []
+        # path -> stat signature of every file and conf-dir read, taken
+        # before reading it.
+        self.dependencies = {}
+
+    def __len__(self):
+        return (len(self.hosts) + len(self.ranges) + len(self.addresses) + len(self.host_records)
+                + len(self.includes) + len(self.options))
+
+
+def conf_dir_files(value):
+    # conf-dir=<dir>[,<ext to skip>...][,*<ext to read>...], read in name
+    # order, skipping the backup and hidden files dnsmasq skips.
+    directory, *suffixes = [part.strip() for part in value.split(',')]
+    wanted = [suffix[1:] for suffix in suffixes if suffix.startswith('*')]
+    skipped = [suffix for suffix in suffixes if suffix and not suffix.startswith('*')]
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('.') or name.endswith('~') or (name.startswith('#') and name.endswith('#')):
+            continue
+        if wanted and not name.endswith(tuple(wanted)):
+            continue
+        if skipped and name.endswith(tuple(skipped)):
+            continue
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            yield path
+
+
+def parse_dnsmasq_config(path, config=None, seen=None):
+    # One streaming pass over the file; conf-file and conf-dir includes are
+    # parsed where they appear, each file at most once.
+    config = config if config is not None else DnsmasqConfig()
+    seen = seen if seen is not None else set()
+    real_path = os.path.realpath(path)
+    if real_path in seen:
+        return config
+    seen.add(real_path)
+    config.dependencies[path] = FileCache.signature(path)
+
+    with open(path, 'r') as f:
+        for number, text in enumerate(f, 1):
+            line = text.strip()
+            if not line or line[0] == '#':
+                continue
+            if '#' in line:
+                line = CONFIG_COMMENT_RE.sub('', line)
+            key, _, value = line.partition('=')
+            key = key.strip()
+            value = value.strip()
+            source = ConfigSource(path, number, text)
+            parser = CONFIG_PARSERS.get(key)
+            if parser:
+                getattr(config, parser[0]).append(parser[1](value, source))
+            elif key in ('conf-file', 'conf-dir'):
+                config.includes.append(ConfigInclude(key, value, source))
+                try:
+                    if key == 'conf-file':
+                        parse_dnsmasq_config(value, config, seen)
+                    else:
+                        directory = value.split(',')[0].strip()
+                        config.dependencies[directory] = FileCache.signature(directory)
+                        for include in conf_dir_files(value):
+                            parse_dnsmasq_config(include, config, seen)
+                except OSError as e:
+                    logging.warning(f"Cannot read {key} {value} included from {path}:{number}: {str(e)}")
+            else:
+                config.options.append(ConfigOption(key, value, source))
+    return config
+
+
+config_cache = FileCache('config')
+
+
+def entry_to_host(entry):
+    return Host(entry.macs[0], entry.hostname or '', entry.ip or '')
+
+
+def render_host_fields(host, entry=None):
+    # Writes the host's MAC, hostname and IP into the fields of the entry it
+    # was parsed from, keeping every other field and the comment as they
+    # were.
+    if entry is None:
+        return format_host_entry(*host)
+    tokens = list(entry.tokens)
+    for old, new in ((entry.macs[0], host.mac), (entry.hostname, host.hostname), (entry.ip, host.ip)):
+        if old is not None and new:
+            tokens[tokens.index(old)] = new
+        elif old is not None:
+            tokens.remove(old)
+        elif new:
+            tokens.append(new)
+    return ','.join(tokens) + entry.comment
+
+
+def atomic_write(path, lines):
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', dir=directory)
+    except PermissionError:
+        logging.warning(f"Cannot create a temporary file next to {path}, rewriting it in place")
+        with open(path, 'w') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        return
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            st = os.stat(path)
+            os.chmod(tmp_path, st.st_mode & 0o7777)
+            try:
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            except PermissionError:
+                pass
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def parse_dhcp_hosts(path):
+    config = parse_dnsmasq_config(path)
+    store = HostStore()
+    for entry in config.hosts:
+        store.load_entry(entry)
+    store.dependencies = config.dependencies
+    logging.info(f"Read {len(store)} hosts from configuration ({len(config.dependencies)} files)")
+    return store
+
+
+def is_tombstone(line):
+    return line.startswith('#') and len(line) > 1 and not line[1:].strip()
+
+
+def parse_hostsfile(path):
+    store = HostStore()
+    offset = 0
+    with open(path, 'rb') as f:
+        for number, raw in enumerate(f, 1):
+            line = raw.decode()
+            if is_tombstone(line):
+                store.tombstones += 1
+                # Managed, so the next rewrite drops it.
+                store.sources[(path, number)] = line_crc(line)
+            elif line.strip() and not line.lstrip().startswith('#'):
+                store.load_entry(parse_host_fields(line.strip(), ConfigSource(path, number, line)), offset)
+            offset += len(raw)
+            store.line_count = number
+    logging.info(f"Read {len(store)} hosts from {path}")
+    return store
+
+
+_hostsfile_checked = False
+
+
+def ensure_hostsfile():
+    # Moves dhcp-host= lines out of dnsmasq.conf into DHCP_HOSTSFILE and adds
+    # the dhcp-hostsfile= directive, once per process.
+    global _hostsfile_checked
+    if not DHCP_HOSTSFILE or _hostsfile_checked:
+        return
+    with hosts_file_lock():
+        if _hostsfile_checked:
+            return
+        _hostsfile_checked = True
+        try:
+            with open(DNSMASQ_CONF, 'r') as f:
+                content = f.readlines()
+            directive = f'dhcp-hostsfile={DHCP_HOSTSFILE}'
+            moved = {entry.source.line: entry for entry in parse_dnsmasq_config(DNSMASQ_CONF).hosts
+                     if entry.source.path == DNSMASQ_CONF}
+            entries = [','.join(entry.tokens) for entry in moved.values()]
+            has_directive = any(line.strip() == directive for line in content)
+
+            if entries or not has_directive:
+                snapshot_before_write('before moving hosts to the hostsfile')
+            if entries or not os.path.exists(DHCP_HOSTSFILE):
+                existing = []
+                if os.path.exists(DHCP_HOSTSFILE):
+                    with open(DHCP_HOSTSFILE, 'r') as f:
+                        existing = f.readlines()
+                if existing and not existing[-1].endswith('\n'):
+                    existing[-1] += '\n'
+                atomic_write(DHCP_HOSTSFILE, existing + [e if e.endswith('\n') else e + '\n' for e in entries])
+
+            if entries or not has_directive:
+                new_content = [line for number, line in enumerate(content, 1) if number not in moved]
+                if not has_directive:
+                    if new_content and not new_content[-1].endswith('\n'):
+                        new_content[-1] += '\n'
+                    new_content.append(directive + '\n')
+                atomic_write(DNSMASQ_CONF, new_content)
+                reload_scheduler.schedule('restart')
+                logging.info(f"Moved {len(entries)} hosts from {DNSMASQ_CONF} to {DHCP_HOSTSFILE}")
+        except Exception as e:
+            logging.error(f"Error setting up DHCP hostsfile: {str(e)}")
+
+
+def load_host_snapshot():
+    # The store together with the stat signature it was validated against.
+    try:
+        if DHCP_HOSTSFILE:
+            ensure_hostsfile()
+            return host_cache.lookup(DHCP_HOSTSFILE, parse_hostsfile)
+        return host_cache.lookup(DNSMASQ_CONF, parse_dhcp_hosts)
+    except Exception as e:
+        logging.error(f"Error reading DHCP hosts: {str(e)}")
+        return HostStore(), None
+
+
+def load_host_store():
+    return load_host_snapshot()[0]
+
+
+def config_version(signature):
+    if signature is None:
+        return '0'
+    _, inode, size, mtime_ns = signature
+    return f'{inode:x}-{size:x}-{mtime_ns:x}'
+
+
+def read_dhcp_hosts():
+    # A read-only sequence of Host tuples, built as they are read.
+    return load_host_store().view()
+
+
+def rewrite_host_lines(store, path, prefix):
+    # Applies the store to the files its entries came from. Managed lines are
+    # kept byte-for-byte, re-rendered or dropped; every other line is left
+    # alone, and hosts without a line yet are appended to `path`. A managed
+    # line whose text changed on disk since it was read is not touched.
+    # Afterwards the store knows the new number and offset of each of its
+    # lines; returns False if a line was left alone, when it does not.
+    edits = {}
+    rows = {}
+    for row, file_path, number, crc, host, entry, changed in store.lines():
+        if row is not None:
+            rows.setdefault(file_path, {})[number] = row
+        if changed:
+            fields = render_host_fields(host, entry) if host else None
+            edits.setdefault(file_path, {})[number] = (crc, fields)
+
+    appended = [(row, render_host_fields(host, entry)) for row, host, entry in store.unplaced()]
+    if appended:
+        edits.setdefault(path, {})
+    clean = True
+    for file_path, changes in edits.items():
+        with open(file_path, 'r') as f:
+            content = f.readlines()
+        file_rows = rows.get(file_path, {})
+        placed = {}
+        new_content = []
+        offset = 0
+        for number, line in enumerate(content, 1):
+            change = changes.get(number)
+            fields = None
+            if change is not None and change[0] != line_crc(line):
+                logging.warning(f"{file_path}:{number} changed on disk, leaving it as it is")
+                clean = False
+            elif change is not None:
+                if change[1] is None:
+                    continue
+                fields = change[1]
+                line = prefix + fields + '\n'
+            if number in file_rows:
+                placed[file_rows[number]] = (len(new_content) + 1, offset, line, fields)
+            new_content.append(line)
+            offset += len(line.encode())
+        if file_path == path and appended:
+            if new_content and not new_content[-1].endswith('\n'):
+                new_content[-1] += '\n'
+                offset += 1
+            for row, fields in appended:
+                line = prefix + fields + '\n'
+                placed[row] = (len(new_content) + 1, offset, line, fields)
+                new_content.append(line)
+                offset += len(line.encode())
+        atomic_write(file_path, new_content)
+        store.rewritten(file_path, placed)
+        if file_path == path:
+            store.line_count = len(new_content)
+        # Replacing the file also changes the conf-dir it is in.
+        written = os.path.normpath(file_path)
+        for dependency in store.dependencies:
+            if os.path.normpath(dependency) in (written, os.path.dirname(written)):
+                store.dependencies[dependency] = FileCache.signature(dependency)
+    return clean
+
+
+def write_dhcp_hosts(hosts):
+    snapshot_before_write('before write')
+    try:
+        if DHCP_HOSTSFILE:
+            path, prefix, parse = DHCP_HOSTSFILE, '', parse_hostsfile
+        else:
+            path, prefix, parse = DNSMASQ_CONF, 'dhcp-host=', parse_dhcp_hosts
+        if isinstance(hosts, HostStore):
+            store = hosts
+        else:
+            # A plain host list replaces the hosts currently on disk.
+            store = parse(path)
+            store.assign(hosts)
+        if rewrite_host_lines(store, path, prefix):
+            # The store has its new line numbers, so it stays the cached
+            # copy instead of the files being parsed again.
+            host_cache.put(path, store)
+        else:
+            host_cache.invalidate()
+
+        logging.info(f"Wrote {len(store)} hosts to configuration")
+    except Exception as e:
+        host_cache.invalidate()
+        metrics.inc('dhcp_dashboard_host_write_errors_total')
+        logging.error(f"Error writing DHCP hosts: {str(e)}")
+        raise
+
+
+def _tombstone_line(f, offset, host):
+    # Returns the blanked line, or None if the line is not the host's.
+    f.seek(offset)
+    raw = f.readline()
+    entry = parse_host_fields(raw.decode().strip())
+    if not entry.macs or normalize_mac(entry.macs[0]) != normalize_mac(host.mac):
+        return None
+    body = len(raw) - 1 if raw.endswith(b'\n') else len(raw)
+    tombstone = b'#' + b' ' * (body - 1)
+    f.seek(offset)
+    f.write(tombstone)
+    return (tombstone + raw[body:]).decode()
+
+
+def save_host_changes(store, added=(), removed=()):
+    # Persists a mutation already applied to the cached store. In hostsfile
+    # mode removals blank their line in place and additions are appended,
+    # so a single change touches only its own bytes.
+    if added:
+        metrics.inc('dhcp_dashboard_host_changes_total', (('change', 'added'),), len(added))
+    if removed:
+        metrics.inc('dhcp_dashboard_host_changes_total', (('change', 'removed'),), len(removed))
+    if not DHCP_HOSTSFILE:
+        write_dhcp_hosts(store)
+        return
+
+    try:
+        with open(DHCP_HOSTSFILE, 'r+b') as f:
+            for host in removed:
+                offset, number = store.released_line(host.mac)
+                text = _tombstone_line(f, offset, host) if offset is not None else None
+                if text is None:
+                    break
+                store.release_line(host.mac)
+                store.sources[(DHCP_HOSTSFILE, number)] = line_crc(text)
+                store.tombstones += 1
+            else:
+                if added:
+                    end = f.seek(0, os.SEEK_END)
+                    if end:
+                        f.seek(end - 1)
+                        if f.read(1) != b'\n':
+                            f.write(b'\n')
+                            end += 1
+                            store.extend_line(DHCP_HOSTSFILE, store.line_count, '\n')
+                    for host in added:
+                        text = render_host_fields(host, store.entry(host.mac)) + '\n'
+                        store.line_count += 1
+                        store.place(host.mac, DHCP_HOSTSFILE, store.line_count, text, end)
+                        line = text.encode()
+                        f.write(line)
+                        end += len(line)
+                f.flush()
+                os.fsync(f.fileno())
+                if store.tombstones > max(HOSTSFILE_COMPACT_MIN, len(store) // 4):
+                    write_dhcp_hosts(store)
+                else:
+                    host_cache.put(DHCP_HOSTSFILE, store)
+                logging.info(f"Saved {len(added)} added and {len(removed)} removed hosts to {DHCP_HOSTSFILE}")
+                return
+        # The file no longer matches the recorded offsets, and the removals
+        # before this one are already blanked on disk: apply the change to
+        # the hosts the file holds now and rewrite it from those.
+        logging.warning(f"{DHCP_HOSTSFILE} changed unexpectedly, rewriting it")
+        store = parse_hostsfile(DHCP_HOSTSFILE)
+        for host in removed:
+            store.remove(host.mac)
+        for host in added:
+            store.replace(host.mac, host)
+        write_dhcp_hosts(store)
+    except Exception as e:
+        host_cache.invalidate()
+        metrics.inc('dhcp_dashboard_host_write_errors_total')
+        logging.error(f"Error saving DHCP hosts: {str(e)}")
+        raise
+
+
+class PreconditionFailed(Exception):
+    def __init__(self, etag):
+        super().__init__(f'Host configuration has changed (current version {etag})')
+        self.etag = etag
+
+
+_hosts_lock_state = threading.local()
+
+
+@contextmanager
+def hosts_file_lock():
+    # host_lock serializes threads in this process and an flock on a shared
+    # lock file serializes worker processes. Nested use in the same thread
+    # (ensure_hostsfile() inside a transaction) reuses the held lock.
+    if getattr(_hosts_lock_state, 'held', False):
+        yield
+        return
+    with host_lock:
+        with open(os.path.join(RUN_DIR, 'dhcp_dashboard.hosts.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _hosts_lock_state.held = True
+            try:
+                yield
+            finally:
+                _hosts_lock_state.held = False
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def parse_version_file(path):
+    with open(path, 'r') as f:
+        record = json.load(f)
+    return record.get('version', 0), record.get('signature')
+
+
+version_cache = FileCache('version')
+
+
+def read_version_record():
+    try:
+        return version_cache.get(CONFIG_VERSION_FILE, parse_version_file)
+    except FileNotFoundError:
+        return 0, None
+    except Exception as e:
+        logging.error(f"Error reading config version: {str(e)}")
+        return 0, None
+
+
+def current_config_version(record, signature):
+    # A signature other than the one recorded by the last commit means the
+    # file was edited outside a transaction; the next commit records that
+    # as a version of its own, so it is counted here already.
+    version, recorded = record
+    if signature is not None and list(signature) != recorded:
+        version += 1
+    return version
+
+
+def config_etag(signature):
+    return f'{current_config_version(read_version_record(), signature)}-{config_version(signature)}'
+
+
+def coded_etag(etag, encoding):
+    # Compressed bodies differ byte for byte, so each content coding gets
+    # its own strong validator.
+    return etag if encoding == 'identity' else f'{etag}-{encoding}'
+
+
+def matching_etag(etags, etag):
+    # The tag in `etags` that names `etag` in any content coding, or None.
+    for coding in ('identity', 'gzip', 'br'):
+        if etags.contains(coded_etag(etag, coding)):
+            return coded_etag(etag, coding)
+    return None
+
+
+class HostTransaction:
+    def __init__(self, store, signature, version):
+        self.store = store
+        self.signature = signature
+        self.version = version
+
+    @property
+    def etag(self):
+        return f'{self.version}-{config_version(self.signature)}'
+
+
+_loaded_version = None
+
+
+@contextmanager
+def host_transaction(if_match=None):
+    # Read-modify-write of the reservation list. The store is revalidated
+    # under hosts_file_lock(), If-Match is checked against the current
+    # version, and a change to the file is committed as a new version.
+    global _loaded_version
+    with hosts_file_lock():
+        version_cache.invalidate()
+        record = read_version_record()
+        if record[0] != _loaded_version:
+            # Another worker committed since this process last loaded the
+            # store; a tombstone edit can leave the stat signature unchanged.
+            host_cache.invalidate()
+        store, signature = load_host_snapshot()
+        transaction = HostTransaction(store, signature, current_config_version(record, signature))
+        if if_match is not None and matching_etag(if_match, transaction.etag) is None:
+            raise PreconditionFailed(transaction.etag)
+
+        try:
+            yield transaction
+        except Exception:
+            host_cache.invalidate()
+            raise
+        finally:
+            path = DHCP_HOSTSFILE or DNSMASQ_CONF
+            try:
+                new_signature = FileCache.signature(path)
+            except OSError:
+                new_signature = None
+            if new_signature != signature:
+                transaction.version += 1
+                transaction.signature = new_signature
+            if new_signature is not None and (transaction.version, list(new_signature)) != record:
+                try:
+                    atomic_write(CONFIG_VERSION_FILE, [json.dumps({
+                        'version': transaction.version,
+                        'signature': list(new_signature),
+                    })])
+                    version_cache.put(CONFIG_VERSION_FILE, (transaction.version, list(new_signature)))
+                except Exception as e:
+                    logging.error(f"Error recording config version: {str(e)}")
+            _loaded_version = transaction.version
+            logging.debug(f"Host configuration at version {transaction.version}")
+
+
+def if_match_header():
+    # None when the request carries no If-Match, so it is not treated as a
+    # precondition that nothing matches.
+    return request.if_match if 'If-Match' in request.headers else None
+
+
+def precondition_failed_response(e):
+    response = jsonify({'error': str(e)})
+    response.set_etag(e.etag)
+    return response, 412
+
+
+Lease = namedtuple('Lease', ['expires', 'mac', 'ip', 'hostname', 'client_id'])
+
+
+class LeaseTable:
+    def __init__(self, leases, lines):
+        self.leases = leases
+        # Raw line -> Lease, so the next parse can reuse unchanged entries.
+        self.lines = lines
+        self._by_mac = {}
+        self._by_ip = {}
+        for lease in leases:
+            if lease.mac:
+                self._by_mac[normalize_mac(lease.mac)] = lease
+            self._by_ip[lease.ip] = lease
+
+    def __len__(self):
+        return len(self.leases)
+
+    def get(self, mac):
+        return self._by_mac.get(normalize_mac(mac))
+
+    def find_by_ip(self, ip):
+        return self._by_ip.get(ip)
+
+
+def parse_lease_line(line):
+    fields = line.split()
+    if len(fields) < 4 or fields[0] == 'duid':
+        return None
+    try:
+        expires = int(fields[0])
+    except ValueError:
+        return None
+    # DHCPv6 leases carry an IAID where DHCPv4 leases have the MAC address.
+    mac = fields[1] if '.' in fields[2] else None
+    hostname = fields[3] if fields[3] != '*' else None
+    client_id = fields[4] if len(fields) > 4 and fields[4] != '*' else None
+    return Lease(expires, mac, fields[2], hostname, client_id)
+
+
+def parse_leases(path):
+    previous = lease_cache.peek()
+    known = previous.lines if previous is not None else {}
+    leases = []
+    lines = {}
+    with open(path, 'r') as f:
+        for line in f:
+            lease = known.get(line)
+            if lease is None:
+                lease = parse_lease_line(line)
+            if lease is not None:
+                leases.append(lease)
+                lines[line] = lease
+    logging.info(f"Read {len(leases)} leases from {path}")
+    return LeaseTable(leases, lines)
+
+
+lease_cache = FileCache('leases')
+
+
+def load_leases():
+    try:
+        return lease_cache.get(DNSMASQ_LEASES, parse_leases)
+    except Exception as e:
+        logging.error(f"Error reading DHCP leases: {str(e)}")
+        return LeaseTable([], {})
+
+
+def record_dnsmasq_action(action, started, result):
+    labels = (('action', action),)
+    metrics.inc('dhcp_dashboard_dnsmasq_actions_total', labels + (('result', result),))
+    metrics.observe('dhcp_dashboard_dnsmasq_action_duration_seconds', time.perf_counter() - started, labels)
+    status_monitor.poke()
+
+
+def restart_dnsmasq():
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(['sudo', 'systemctl', 'restart', 'dnsmasq'], capture_output=True, text=True,
+                                timeout=SUBPROCESS_TIMEOUT)
+        if result.returncode != 0:
+            status_output = format_dnsmasq_status(status_monitor.refresh())
+            logging.error(f"Error restarting DNSMASQ: {result.stderr}\nStatus: {status_output}")
+            raise Exception(f"Failed to restart DNSMASQ. Status: {status_output}")
+        record_dnsmasq_action('restart', started, 'ok')
+        logging.info("DNSMASQ restarted successfully")
+    except Exception as e:
+        record_dnsmasq_action('restart', started, 'error')
+        logging.error(f"Exception when restarting DNSMASQ: {str(e)}")
+        raise
+
+
+def reload_dnsmasq():
+    started = time.perf_counter()
+    try:
+        # The dnsmasq unit's reload is a SIGHUP: hosts files and leases are
+        # re-read without dropping the DNS/DHCP service.
+        result = subprocess.run(['sudo', 'systemctl', 'reload', 'dnsmasq'], capture_output=True, text=True,
+                                timeout=SUBPROCESS_TIMEOUT)
+        if result.returncode != 0:
+            logging.error(f"Error reloading DNSMASQ: {result.stderr}")
+            raise Exception(f"Failed to reload DNSMASQ: {result.stderr.strip()}")
+        record_dnsmasq_action('reload', started, 'ok')
+        logging.info("DNSMASQ reloaded successfully")
+    except Exception as e:
+        record_dnsmasq_action('reload', started, 'error')
+        logging.error(f"Exception when reloading DNSMASQ: {str(e)}")
+        raise
+
+
+def apply_dnsmasq_changes(action, since=None):
+    # Worker processes share a stamp file recording when the last apply
+    # started. An apply that started after `since` (when the first change of
+    # this batch was written) already covers it, so this one is skipped.
+    with open(os.path.join(RUN_DIR, 'dhcp_dashboard.reload'), 'a+') as stamp:
+        fcntl.flock(stamp, fcntl.LOCK_EX)
+        stamp.seek(0)
+        try:
+            last = json.loads(stamp.read() or '{}')
+        except ValueError:
+            last = {}
+        if since is not None and last.get('started', 0) >= since and \
+                ReloadScheduler.ACTIONS.index(last.get('action', 'reload')) >= ReloadScheduler.ACTIONS.index(action):
+            logging.info(f"DNSMASQ {action} already applied by another worker")
+            return 'skipped'
+        started = time.time()
+        performed = _apply_dnsmasq_action(action)
+        stamp.seek(0)
+        stamp.truncate()
+        stamp.write(json.dumps({'started': started, 'action': performed, 'pid': os.getpid()}))
+        return performed
+
+
+def _apply_dnsmasq_action(action):
+    if action == 'reload':
+        try:
+            reload_dnsmasq()
+            return 'reload'
+        except Exception:
+            logging.warning("Falling back to a DNSMASQ restart")
+    restart_dnsmasq()
+    return 'restart'
+
+
+class ReloadScheduler:
+    # Coalesces dnsmasq reload/restart requests: every request within the
+    # debounce window is satisfied by a single apply on a background thread.
+    ACTIONS = ('reload', 'restart')
+
+    def __init__(self, apply, delay, max_delay):
+        self._apply = apply
+        self._delay = delay
+        self._max_delay = max_delay
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pending = None
+        self._first_request = None
+        self._first_request_time = None
+        self._last_request = None
+        self._applying = False
+        self.requested = 0
+        self.applied = 0
+        self.last_result = None
+
+    def schedule(self, action='reload'):
+        with self._cond:
+            now = time.monotonic()
+            if self._pending is None:
+                self._pending = action
+                self._first_request = now
+                self._first_request_time = time.time()
+            elif self.ACTIONS.index(action) > self.ACTIONS.index(self._pending):
+                self._pending = action
+            self._last_request = now
+            self.requested += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='dnsmasq-reload', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return self.requested
+
+    def wait(self, generation, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self.applied < generation:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def status(self):
+        with self._cond:
+            return {
+                'pending': self._pending,
+                'applying': self._applying,
+                'requested': self.requested,
+                'applied': self.applied,
+                'last_result': self.last_result,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                while True:
+                    deadline = min(self._last_request + self._delay, self._first_request + self._max_delay)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                action = self._pending
+                since = self._first_request_time
+                generation = self.requested
+                self._pending = None
+                self._applying = True
+
+            started = time.time()
+            try:
+                performed = self._apply(action, since)
+                result = {'status': 'ok', 'action': performed, 'error': None}
+            except Exception as e:
+                result = {'status': 'error', 'action': action, 'error': str(e)}
+            result['started'] = datetime.fromtimestamp(started).isoformat()
+            result['duration'] = round(time.time() - started, 3)
+            result['changes'] = generation - self.applied
+
+            with self._cond:
+                self._applying = False
+                self.applied = generation
+                self.last_result = result
+                self._cond.notify_all()
+
+
+reload_scheduler = ReloadScheduler(apply_dnsmasq_changes, RELOAD_DELAY, RELOAD_MAX_DELAY)
+
+
+def host_change_action():
+    # SIGHUP does not make dnsmasq re-read dnsmasq.conf itself, so dhcp-host
+    # lines kept there need a restart to take effect; a hostsfile only needs
+    # a reload.
+    return 'reload' if DHCP_HOSTSFILE else 'restart'
+
+
+def schedule_dnsmasq_apply():
+    generation = reload_scheduler.schedule(host_change_action())
+    logging.info(f"Scheduled DNSMASQ {host_change_action()} (change #{generation})")
+    return generation
+
+
+DNSMASQ_STATUS_PROPERTIES = ('ActiveState', 'SubState', 'Result', 'MainPID', 'NRestarts', 'MemoryCurrent',
+                             'ActiveEnterTimestampMonotonic')
+
+
+def parse_systemctl_show(output):
+    properties = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            properties[key] = value
+    return properties
+
+
+def systemctl_number(value):
+    # systemctl show prints [not set] or an empty value for unknown numbers.
+    return int(value) if value and value.isdigit() else None
+
+
+def probe_dnsmasq_status():
+    # One `systemctl show` (readable without sudo) instead of parsing the
+    # text of `systemctl status`, plus the end of the dnsmasq log.
+    checked = time.time()
+    try:
+        result = subprocess.run(['systemctl', 'show', 'dnsmasq', '--property=' + ','.join(DNSMASQ_STATUS_PROPERTIES)],
+                                capture_output=True, text=True, timeout=SUBPROCESS_TIMEOUT)
+        if result.returncode != 0:
+            raise Exception(result.stderr.strip() or f"systemctl exited with {result.returncode}")
+        properties = parse_systemctl_show(result.stdout)
+    except Exception as e:
+        logging.error(f"Error getting DNSMASQ status: {str(e)}")
+        return {'active_state': 'unknown', 'error': str(e), 'checked_at': checked}
+
+    pid = systemctl_number(properties.get('MainPID'))
+    entered = systemctl_number(properties.get('ActiveEnterTimestampMonotonic'))
+    active = properties.get('ActiveState') == 'active'
+    # Both are CLOCK_MONOTONIC, in microseconds for systemd.
+    uptime = round(time.monotonic() - entered / 1e6, 1) if active and entered else None
+    try:
+        log, _ = tail_log_lines(DNSMASQ_LOG_FILE, DNSMASQ_STATUS_LOG_LINES)
+    except OSError:
+        log = []
+    return {
+        'active_state': properties.get('ActiveState', 'unknown'),
+        'sub_state': properties.get('SubState'),
+        'result': properties.get('Result'),
+        'pid': pid or None,
+        'restarts': systemctl_number(properties.get('NRestarts')),
+        'memory_bytes': systemctl_number(properties.get('MemoryCurrent')),
+        'uptime_seconds': uptime,
+        'started': datetime.fromtimestamp(checked - uptime).isoformat(timespec='seconds') if uptime else None,
+        'log': [line.rstrip('\r\n') for line in log],
+        'error': None,
+        'checked_at': checked,
+    }
+
+
+class DnsmasqStatusMonitor:
+    # Probes the dnsmasq service every `interval` seconds on a background
+    # thread and keeps the result, so requests only ever read the cached
+    # status. Workers share the latest result through a file in RUN_DIR and
+    # only probe when it is older than the interval.
+    def __init__(self, probe, interval):
+        self._probe = probe
+        self._interval = interval
+        self._cond = threading.Condition()
+        self._thread = None
+        self._status = None
+        self._wake = False
+
+    @property
+    def path(self):
+        return os.path.join(RUN_DIR, 'dhcp_dashboard.status.json')
+
+    def get(self):
+        self._ensure_thread()
+        with self._cond:
+            if self._status is None:
+                self._status = self._read_shared()
+            status = dict(self._status or {'active_state': 'unknown', 'error': 'Not checked yet', 'checked_at': None})
+        if status['checked_at'] is not None:
+            status['age_seconds'] = round(max(time.time() - status['checked_at'], 0), 1)
+            status['checked'] = datetime.fromtimestamp(status['checked_at']).isoformat(timespec='seconds')
+        return status
+
+    def poke(self):
+        # Probe again now, e.g. after a restart or reload.
+        with self._cond:
+            self._wake = True
+            self._cond.notify_all()
+        self._ensure_thread()
+
+    def refresh(self):
+        # Probes in the calling thread; only for background work.
+        status = self._poll(force=True)
+        with self._cond:
+            self._status = status
+        return self.get()
+
+    def _ensure_thread(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='dnsmasq-status', daemon=True)
+                self._thread.start()
+
+    def _read_shared(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _poll(self, force=False):
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            shared = self._read_shared()
+            if not force and shared and time.time() - shared.get('checked_at', 0) < self._interval:
+                return shared
+            status = self._probe()
+            try:
+                with open(self.path + '.tmp', 'w') as f:
+                    json.dump(status, f)
+                os.replace(self.path + '.tmp', self.path)
+            except OSError as e:
+                logging.error(f"Error saving DNSMASQ status: {str(e)}")
+            return status
+
+    def _run(self):
+        force = False
+        while True:
+            try:
+                status = self._poll(force)
+            except Exception as e:
+                logging.error(f"Error in DNSMASQ status monitor: {str(e)}")
+                status = None
+            with self._cond:
+                if status is not None:
+                    self._status = status
+                if not self._wake:
+                    self._cond.wait(self._interval)
+                force = self._wake
+                self._wake = False
+
+
+status_monitor = DnsmasqStatusMonitor(probe_dnsmasq_status, STATUS_INTERVAL)
+
+
+def format_uptime(seconds):
+    minutes, _ = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f'{days}d {hours}h {minutes}m'
+    return f'{hours}h {minutes}m' if hours else f'{minutes}m'
+
+
+def format_dnsmasq_status(status):
+    lines = [f"DNSMASQ is {status['active_state']}" + (f" ({status['sub_state']})" if status.get('sub_state') else '')]
+    if status.get('pid'):
+        lines.append(f"PID {status['pid']}")
+    if status.get('uptime_seconds') is not None:
+        lines.append(f"Running since {status['started'].replace('T', ' ')} ({format_uptime(status['uptime_seconds'])})")
+    if status.get('memory_bytes') is not None:
+        lines.append(f"Memory {status['memory_bytes'] / (1024 * 1024):.1f} MB")
+    if status.get('restarts'):
+        lines.append(f"Restarted automatically {status['restarts']} times")
+    if status.get('error'):
+        lines.append(f"Error: {status['error']}")
+    if status.get('checked'):
+        lines.append(f"Checked {status['checked'].replace('T', ' ')}")
+    if status.get('log'):
+        lines.append('')
+        lines.extend(status['log'])
+    return '\n'.join(lines)
+
+
+class BackupNotFound(Exception):
+    pass
+
+
+def backup_paths():
+    # dnsmasq.conf and the files host edits write to: the conf-file and
+    # conf-dir files it includes, or the hostsfile. The includes are the
+    # dependencies of the host store, which the write has just read, so
+    # listing them parses nothing.
+    if DHCP_HOSTSFILE:
+        return [DNSMASQ_CONF, DHCP_HOSTSFILE]
+    store = host_cache.peek()
+    if store is None:
+        store = load_host_store()
+    paths = [DNSMASQ_CONF]
+    paths += [path for path in store.dependencies if path not in paths and os.path.isfile(path)]
+    return paths
+
+
+class BackupStore:
+    # Snapshots of the files in backup_paths(). Each distinct file content
+    # is stored once as objects/<sha256>.gz and index.json lists the
+    # snapshots referencing them, so an unchanged file costs nothing and a
+    # restore reads only the blobs of the snapshot being restored.
+    def __init__(self, directory, keep, max_age_days):
+        self.directory = directory
+        self.keep = keep
+        self.max_age = max_age_days * 86400
+
+    @property
+    def objects(self):
+        return os.path.join(self.directory, 'objects')
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def list(self):
+        return list(reversed(self._load_index()))
+
+    def get(self, snapshot_id):
+        for snapshot in self._load_index():
+            if snapshot['id'] == snapshot_id:
+                return snapshot
+        raise BackupNotFound(f"Backup {snapshot_id} not found")
+
+    def read(self, entry):
+        with gzip.open(os.path.join(self.objects, entry['sha256'] + '.gz'), 'rb') as f:
+            return f.read()
+
+    def _store_object(self, digest, content):
+        path = os.path.join(self.objects, digest + '.gz')
+        if os.path.exists(path):
+            return
+        fd, tmp_path = tempfile.mkstemp(prefix='.object.', dir=self.objects)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(content, compresslevel=BACKUP_GZIP_LEVEL))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def snapshot(self, reason):
+        # Returns the new snapshot, or the latest one if no file changed.
+        with hosts_file_lock():
+            os.makedirs(self.objects, exist_ok=True)
+            snapshots = self._load_index()
+            latest = snapshots[-1] if snapshots else None
+            files = {}
+            for path in backup_paths():
+                try:
+                    signature = list(FileCache.signature(path))
+                except FileNotFoundError:
+                    continue
+                previous = latest['files'].get(path) if latest else None
+                if previous and previous['signature'] == signature:
+                    # Untouched since the last snapshot, so not even read.
+                    files[path] = previous
+                    continue
+                with open(path, 'rb') as f:
+                    content = f.read()
+                digest = hashlib.sha256(content).hexdigest()
+                self._store_object(digest, content)
+                files[path] = {'sha256': digest, 'size': len(content), 'signature': signature}
+
+            manifest = {path: entry['sha256'] for path, entry in files.items()}
+            if latest and manifest == {path: entry['sha256'] for path, entry in latest['files'].items()}:
+                if files != latest['files']:
+                    latest['files'] = files
+                    atomic_write(self.index_path, [json.dumps(snapshots)])
+                return latest
+
+            now = time.time()
+            digest = hashlib.sha256(f'{now}{json.dumps(manifest, sort_keys=True)}'.encode()).hexdigest()
+            snapshot = {
+                'id': f"{datetime.fromtimestamp(now).strftime('%Y%m%d-%H%M%S')}-{digest[:8]}",
+                'created': datetime.fromtimestamp(now).isoformat(),
+                'time': now,
+                'reason': reason,
+                'files': files,
+            }
+            snapshots.append(snapshot)
+            atomic_write(self.index_path, [json.dumps(self._prune(snapshots))])
+            logging.info(f"Backup {snapshot['id']} created ({reason})")
+            return snapshot
+
+    def _prune(self, snapshots):
+        cutoff = time.time() - self.max_age
+        kept = snapshots[-self.keep:]
+        kept = [snapshot for snapshot in kept[:-1] if snapshot['time'] >= cutoff] + kept[-1:]
+        if len(kept) < len(snapshots):
+            referenced = {entry['sha256'] + '.gz' for snapshot in kept for entry in snapshot['files'].values()}
+            for name in os.listdir(self.objects):
+                if name.endswith('.gz') and name not in referenced:
+                    try:
+                        os.remove(os.path.join(self.objects, name))
+                    except OSError:
+                        pass
+            logging.info(f"Pruned {len(snapshots) - len(kept)} old backups")
+        return kept
+
+    def diff(self, snapshot_id, against=None):
+        # Unified diff from the snapshot to another snapshot, or to the
+        # current files when `against` is None.
+        snapshot = self.get(snapshot_id)
+        other = self.get(against) if against else None
+        paths = list(snapshot['files'])
+        paths += [path for path in (other['files'] if other else backup_paths()) if path not in paths]
+        output = []
+        for path in paths:
+            old = self.read(snapshot['files'][path]).decode() if path in snapshot['files'] else ''
+            if other:
+                new = self.read(other['files'][path]).decode() if path in other['files'] else ''
+                label = f'{path}@{other["id"]}'
+            else:
+                try:
+                    with open(path, 'r') as f:
+                        new = f.read()
+                except FileNotFoundError:
+                    new = ''
+                label = path
+            output.extend(difflib.unified_diff(old.splitlines(True), new.splitlines(True),
+                                               f'{path}@{snapshot["id"]}', label))
+        return ''.join(output)
+
+    def restore(self, snapshot_id, if_match=None):
+        # Writes back the snapshot's files that differ from the current ones,
+        # after snapshotting the current state so the restore can be undone.
+        snapshot = self.get(snapshot_id)
+        contents = {path: self.read(entry) for path, entry in snapshot['files'].items()}
+        with host_transaction(if_match) as transaction:
+            self.snapshot(f'before restoring {snapshot_id}')
+            restored = []
+            for path, content in contents.items():
+                try:
+                    with open(path, 'rb') as f:
+                        if f.read() == content:
+                            continue
+                except FileNotFoundError:
+                    pass
+                atomic_write(path, [content.decode()])
+                restored.append(path)
+            host_cache.invalidate()
+        logging.info(f"Restored backup {snapshot_id}: {', '.join(restored) or 'no changes'}")
+        return restored, transaction
+
+
+backup_store = BackupStore(BACKUP_DIR, BACKUP_KEEP, BACKUP_MAX_AGE_DAYS)
+
+
+def snapshot_before_write(reason):
+    # A failed backup is logged but never blocks the configuration change.
+    try:
+        backup_store.snapshot(reason)
+    except Exception as e:
+        logging.error(f"Error creating automatic backup: {str(e)}")
+
+
+def backup_dnsmasq_conf():
+    try:
+        snapshot = backup_store.snapshot('manual')
+        logging.info(f"Backup created: {snapshot['id']}")
+        return snapshot['id']
+    except Exception as e:
+        logging.error(f"Error creating backup: {str(e)}")
+        raise
+
+
+def shutdown_pi():
+    os.system("sudo shutdown -h now")
+
+
+def update_wifi_settings(ssid, password, job=None):
+    try:
+        wpa_config = f'''
+                ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev
+                update_config=1
+                country=BE
+
+                network={{
+                    ssid="{ssid}"
+                    psk="{password}"
+                }}
+        '''
+        with open(WPA_SUPPLICANT_CONF, 'w') as f:
+            f.write(wpa_config)
+
+        # Restart the Wi-Fi interface
+        if job:
+            job.set_progress(10, 'Restarting wlan0')
+        subprocess.run(['sudo', 'ifconfig', 'wlan0', 'down'], check=True, timeout=SUBPROCESS_TIMEOUT)
+        time.sleep(1)
+        subprocess.run(['sudo', 'ifconfig', 'wlan0', 'up'], check=True, timeout=SUBPROCESS_TIMEOUT)
+        time.sleep(2)
+        subprocess.run(['sudo', 'wpa_cli', '-i', 'wlan0', 'reconfigure'], check=True, timeout=SUBPROCESS_TIMEOUT)
+
+        # Wait for the connection to be established
+        for attempt in range(30):  # Wait up to 30 seconds
+            if job:
+                job.check()
+                job.set_progress(20 + attempt * 80 // 30, f'Waiting for {ssid}')
+            result = subprocess.run(['iwgetid', '-r'], capture_output=True, text=True, timeout=SUBPROCESS_TIMEOUT)
+            if result.stdout.strip() == ssid:
+                logging.info(f"Successfully connected to Wi-Fi network: {ssid}")
+                return True
+            time.sleep(1)
+
+        logging.error(f"Failed to connect to Wi-Fi network: {ssid}")
+        return False
+    except JobTimeout:
+        raise
+    except Exception as e:
+        logging.error(f"Error updating Wi-Fi settings: {str(e)}")
+        return False
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    FINISHED = ('succeeded', 'failed', 'timeout')
+
+    def __init__(self, kind, key, timeout):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = 'queued'
+        self.progress = 0
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.timeout = timeout
+        self._done = threading.Event()
+
+    def set_progress(self, progress, message=None):
+        self.progress = progress
+        if message is not None:
+            self.message = message
+        job_manager.save(self)
+
+    def remaining(self):
+        if self.timeout is None or self.started is None:
+            return None
+        return self.started + self.timeout - time.time()
+
+    def check(self):
+        # Long-running job functions call this between steps; threads cannot
+        # be interrupted, so timeouts are cooperative.
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise JobTimeout(f"{self.kind} job exceeded {self.timeout}s")
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'created': datetime.fromtimestamp(self.created).isoformat(),
+            'started': datetime.fromtimestamp(self.started).isoformat() if self.started else None,
+            'finished': datetime.fromtimestamp(self.finished).isoformat() if self.finished else None,
+            'pid': os.getpid(),
+        }
+
+
+class JobManager:
+    # Runs jobs on a bounded thread pool. Jobs submitted with the same key
+    # while one is queued or running collapse into that job. Job records are
+    # also written to RUN_DIR so every worker process can report on them.
+    def __init__(self, workers, queue_limit, history):
+        self._workers = workers
+        self._queue_limit = queue_limit
+        self._history = history
+        self._lock = threading.Lock()
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._active = {}
+
+    @property
+    def directory(self):
+        return os.path.join(RUN_DIR, 'dhcp_dashboard-jobs')
+
+    def submit(self, kind, fn, *args, key=None, timeout=None):
+        with self._lock:
+            if key:
+                existing = self._active.get(key) or self._find_shared_active(key)
+                if existing:
+                    return existing, False
+            if len(self._active) >= self._queue_limit:
+                raise JobQueueFull("Too many jobs are queued")
+            if self._executor is None:
+                # Created lazily so a forked worker never inherits a dead pool.
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='job')
+            job = Job(kind, key, timeout)
+            self._jobs[job.id] = job
+            self._active[key or job.id] = job
+            while len(self._jobs) > self._history:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.status not in Job.FINISHED:
+                    break
+                self._jobs.popitem(last=False)
+        self.save(job)
+        self._executor.submit(self._run, job, fn, args)
+        logging.info(f"Submitted {kind} job {job.id}")
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        return self._load(job_id)
+
+    def list(self, limit=20):
+        jobs = []
+        for name in self._records(newest_first=True)[:limit]:
+            job = self._load(name[:-len('.json')])
+            if job:
+                jobs.append(job)
+        return jobs
+
+    def _records(self, newest_first=False):
+        records = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            try:
+                records.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+            except OSError:
+                continue
+        records.sort(reverse=newest_first)
+        return [name for _, name in records if name.endswith('.json')]
+
+    def save(self, job):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            record = job.to_dict()
+            record['key'] = job.key
+            atomic_write(os.path.join(self.directory, f'{job.id}.json'), [json.dumps(record)])
+            self._prune()
+        except Exception as e:
+            logging.error(f"Error saving job {job.id}: {str(e)}")
+
+    def _load(self, job_id):
+        if not re.match(r'^[0-9a-f]{32}$', job_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, f'{job_id}.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _find_shared_active(self, key):
+        # A job with the same key queued or running in another worker process.
+        for record in self.list(limit=self._history):
+            if record.get('key') == key and record['status'] not in Job.FINISHED and record['pid'] != os.getpid():
+                try:
+                    os.kill(record['pid'], 0)
+                except OSError:
+                    continue
+                return SharedJob(record)
+        return None
+
+    def _prune(self):
+        names = self._records()
+        for name in names[:max(len(names) - self._history, 0)]:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _run(self, job, fn, args):
+        job.status = 'running'
+        job.started = time.time()
+        self.save(job)
+        try:
+            job.result = fn(job, *args)
+            job.status = 'succeeded'
+            job.progress = 100
+        except JobTimeout as e:
+            job.status = 'timeout'
+            job.error = str(e)
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logging.error(f"{job.kind} job {job.id} failed: {str(e)}")
+        job.finished = time.time()
+        with self._lock:
+            self._active.pop(job.key or job.id, None)
+        self.save(job)
+        job._done.set()
+
+
+class SharedJob:
+    # A job owned by another worker process, as seen through its record.
+    def __init__(self, record):
+        self.id = record['id']
+        self.kind = record['kind']
+        self.record = record
+
+    def to_dict(self):
+        return self.record
+
+    def wait(self, timeout=None):
+        return False
+
+
+job_manager = JobManager(JOB_WORKERS, JOB_QUEUE_LIMIT, JOB_HISTORY)
+
+
+def restart_dnsmasq_job(job):
+    restart_dnsmasq()
+    return 'DNSMASQ restarted'
+
+
+def backup_job(job):
+    return f'Backup {backup_dnsmasq_conf()}'
+
+
+def wifi_job(job, ssid, password):
+    if not update_wifi_settings(ssid, password, job):
+        raise Exception(f"Failed to connect to Wi-Fi network {ssid}")
+    return f'Connected to {ssid}'
+
+
+LOG_READ_BLOCK = 64 * 1024
+
+
+def tail_log_lines(path, count):
+    # Reads backwards from the end of the file one block at a time until
+    # enough newlines have been seen; returns the lines and the offset just
+    # past the last complete line.
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        blocks = []
+        newlines = 0
+        while position > 0 and (count <= 0 or newlines <= count):
+            size = min(LOG_READ_BLOCK, position)
+            position -= size
+            f.seek(position)
+            block = f.read(size)
+            blocks.append(block)
+            newlines += block.count(b'\n')
+    data = b''.join(reversed(blocks))
+    # A trailing line without a newline is still being written; leave it for
+    # the next read so that the returned offset always sits on a line boundary.
+    partial = len(data) - data.rfind(b'\n') - 1
+    if partial:
+        data = data[:-partial]
+        end -= partial
+    lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+    if count > 0:
+        lines = lines[-count:]
+    return lines, end
+
+
+def read_log_lines_after(path, offset, limit):
+    # Returns up to `limit` complete lines starting at byte `offset` and the
+    # offset to resume from. An offset past the end means the file was
+    # truncated or rotated, so reading starts over from the beginning.
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        if offset > end:
+            offset = 0
+        f.seek(offset)
+        lines = []
+        while limit <= 0 or len(lines) < limit:
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                break
+            lines.append(line.decode('utf-8', errors='replace'))
+            offset += len(line)
+    return lines, offset
+
+
+LOG_STREAM_POLL_INTERVAL = 0.5
+LOG_STREAM_HEARTBEAT = 15
+LOG_STREAM_QUEUE_SIZE = 1000
+
+
+class LogSubscription:
+    # Bounded per-client buffer. When a slow client falls behind, new lines
+    # are dropped and counted instead of growing memory.
+    def __init__(self, maxsize):
+        self._cond = threading.Condition()
+        self._lines = deque()
+        self._maxsize = maxsize
+        self._dropped = 0
+
+    def put(self, lines):
+        with self._cond:
+            room = self._maxsize - len(self._lines)
+            self._lines.extend(lines[:room])
+            self._dropped += max(len(lines) - room, 0)
+            self._cond.notify()
+
+    def get(self, timeout):
+        with self._cond:
+            if not self._lines and not self._dropped:
+                self._cond.wait(timeout)
+            lines, dropped = list(self._lines), self._dropped
+            self._lines.clear()
+            self._dropped = 0
+            return lines, dropped
+
+
+class AsyncLogSubscription:
+    # The same buffer for asyncio clients: the follower thread hands lines
+    # to the event loop, so a waiting client holds no thread.
+    def __init__(self, loop, maxsize):
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._lines = deque()
+        self._maxsize = maxsize
+        self._dropped = 0
+
+    def put(self, lines):
+        try:
+            self._loop.call_soon_threadsafe(self._put, lines)
+        except RuntimeError:
+            # The event loop has been closed.
+            pass
+
+    def _put(self, lines):
+        room = self._maxsize - len(self._lines)
+        self._lines.extend(lines[:room])
+        self._dropped += max(len(lines) - room, 0)
+        self._event.set()
+
+    async def get(self, timeout):
+        if not self._lines and not self._dropped:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._event.clear()
+        lines, dropped = list(self._lines), self._dropped
+        self._lines.clear()
+        self._dropped = 0
+        return lines, dropped
+
+
+class LogFollower:
+    # Follows one file from a single thread and fans new lines out to every
+    # subscriber. The thread runs only while someone is subscribed.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+
+    def subscribe(self, subscription=None):
+        subscription = subscription or LogSubscription(LOG_STREAM_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'log-follower:{self.path}', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _publish(self, lines):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(lines)
+
+    def _open(self, at_end):
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return None, None
+        if at_end:
+            f.seek(0, os.SEEK_END)
+        return f, os.fstat(f.fileno()).st_ino
+
+    def _run(self):
+        f, inode = self._open(at_end=True)
+        pending = b''
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._thread = None
+                        return
+                if f is None:
+                    f, inode = self._open(at_end=False)
+                if f is not None:
+                    data = f.read()
+                    if data:
+                        pending += data
+                        cut = pending.rfind(b'\n') + 1
+                        if cut:
+                            self._publish(pending[:cut].decode('utf-8', errors='replace').splitlines())
+                            pending = pending[cut:]
+                    try:
+                        st = os.stat(self.path)
+                        rotated = st.st_ino != inode
+                        truncated = st.st_size < f.tell()
+                    except OSError:
+                        rotated, truncated = True, False
+                    if rotated:
+                        # The old file has been drained above; continue with the new one from its start.
+                        f.close()
+                        f, inode = self._open(at_end=False)
+                        pending = b''
+                    elif truncated:
+                        f.seek(0)
+                        pending = b''
+                time.sleep(LOG_STREAM_POLL_INTERVAL)
+        finally:
+            if f is not None:
+                f.close()
+
+
+log_followers = {}
+log_followers_lock = threading.Lock()
+
+
+def get_log_follower(path):
+    with log_followers_lock:
+        if path not in log_followers:
+            log_followers[path] = LogFollower(path)
+        return log_followers[path]
+
+
+def log_segments(path):
+    # The live log followed by its rotated segments, newest first.
+    rotated = [name for name in glob.glob(glob.escape(path) + '.*')
+               if name[len(path) + 1:].split('.')[0].replace('-', '').replace('_', '').isdigit()]
+    rotated.sort(key=os.path.getmtime, reverse=True)
+    return [path] + rotated
+
+
+def read_segment_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return f.read().decode('utf-8', errors='replace').splitlines(keepends=True)
+
+
+def tail_log_segments(path, count):
+    # Last `count` lines of the live log, continuing into rotated segments
+    # when the live file alone is too short.
+    lines, offset = tail_log_lines(path, count)
+    if count > 0:
+        for segment in log_segments(path)[1:]:
+            if len(lines) >= count:
+                break
+            try:
+                older = read_segment_lines(segment)
+            except OSError:
+                continue
+            lines = older[-(count - len(lines)):] + lines
+    return lines, offset
+
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+# The start of a line in each format searched: the JSON and text formats of
+# the dashboard log, and dnsmasq's syslog-style lines (no year or level).
+LOG_LINE_RE = re.compile(rb'^(?:\{"time": "(?P<iso>[^"]+)", "level": "(?P<level>[A-Z]+)"'
+                         rb'|(?P<text>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) (?P<text_level>[A-Z]+) '
+                         rb'|(?P<syslog>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d) )', re.MULTILINE)
+LOG_MAC_RE = re.compile(rb'(?<![0-9A-Fa-f:])[0-9A-Fa-f]{2}(?:[:-][0-9A-Fa-f]{2}){5}(?![0-9A-Fa-f:])')
+LOG_IP_RE = re.compile(rb'(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?![\d.])')
+# The hostname field of JSON lines, and the name at the end of dnsmasq's
+# DHCPACK-style lines ("DHCPACK(wlan0) 10.0.0.5 aa:bb:cc:dd:ee:ff laptop").
+LOG_HOSTNAME_RE = re.compile(rb'"hostname": "([^"\\]+)"|DHCP[A-Z]+\([^)]*\) \S+ [0-9a-fA-F:]{17} (\S+)$',
+                             re.MULTILINE)
+SYSLOG_MONTHS = {name.encode(): number for number, name in
+                 enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+LogQuery = namedtuple('LogQuery', ['since', 'until', 'levels', 'terms', 'text'])
+
+
+def log_line_fields(match, now):
+    # ISO time (local, milliseconds) and level of a LOG_LINE_RE match.
+    if match['iso']:
+        return match['iso'].decode(), match['level'].decode()
+    if match['text']:
+        return match['text'].replace(b' ', b'T').replace(b',', b'.').decode(), match['text_level'].decode()
+    raw = match['syslog']
+    month = SYSLOG_MONTHS.get(raw[:3])
+    if month is None:
+        return None, None
+    # syslog omits the year: a date ahead of now belongs to last year.
+    time = f'{now.year}-{month:02d}-{int(raw[4:6]):02d}T{raw[7:15].decode()}.000'
+    if time[:10] > now.strftime('%Y-%m-%d'):
+        time = f'{now.year - 1}{time[4:]}'
+    return time, None
+
+
+def log_level_mask(level):
+    return 1 << LOG_LEVELS.index(level) if level in LOG_LEVELS else 0
+
+
+def log_term_matches(data):
+    # (term, position) of each index term in a block or line: 'm' + MAC,
+    # 'i' + IPv4 address and 'h' + hostname, all lowercase.
+    for match in LOG_MAC_RE.finditer(data):
+        yield 'm' + match.group().decode().lower().replace('-', ':'), match.start()
+    for match in LOG_IP_RE.finditer(data):
+        yield 'i' + match.group().decode(), match.start()
+    for match in LOG_HOSTNAME_RE.finditer(data):
+        yield 'h' + (match[1] or match[2]).decode('utf-8', errors='replace').lower(), match.start()
+
+
+def summarize_log_block(data, now):
+    # First and last time, level mask, and the lines (offsets into `data`)
+    # each term occurs on, for a block of complete lines.
+    times = []
+    levels = 0
+    for match in LOG_LINE_RE.finditer(data):
+        time, level = log_line_fields(match, now)
+        if time:
+            times.append(time)
+        if level:
+            levels |= log_level_mask(level)
+    postings = {}
+    for term, position in log_term_matches(data):
+        start = data.rfind(b'\n', 0, position) + 1
+        lines = postings.setdefault(term, [])
+        if not lines or lines[-1] != start:
+            lines.append(start)
+    return min(times) if times else '', max(times) if times else '', levels, postings
+
+
+def parse_log_time(value):
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid time {value}')
+    if moment.tzinfo:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.isoformat(timespec='milliseconds')
+
+
+def parse_log_query(args):
+    # Filters of a log search; raises ValueError for invalid ones. A level
+    # matches that level and the more severe ones; since is inclusive and
+    # until exclusive.
+    level = args.get('level', '').upper()
+    if level and level not in LOG_LEVELS:
+        raise ValueError('Unknown level')
+    levels = sum(1 << index for index in range(LOG_LEVELS.index(level), len(LOG_LEVELS))) if level else 0
+    terms = []
+    mac = args.get('mac')
+    if mac:
+        if not MAC_RE.match(normalize_mac(mac)):
+            raise ValueError('Invalid MAC address')
+        terms.append('m' + normalize_mac(mac))
+    ip = args.get('ip')
+    if ip:
+        try:
+            ipaddress.IPv4Address(ip)
+        except ValueError:
+            raise ValueError('Invalid IP address')
+        terms.append('i' + ip)
+    hostname = args.get('hostname')
+    if hostname:
+        terms.append('h' + hostname.lower())
+    q = args.get('q')
+    return LogQuery(parse_log_time(args.get('since')), parse_log_time(args.get('until')), levels, terms,
+                    q.lower().encode() if q else None)
+
+
+class LogIndex:
+    # Incrementally built index of one log file, shared by worker processes
+    # through an append-only file in RUN_DIR: a header naming the log's
+    # inode, then one JSON record per block of about LOG_INDEX_BLOCK bytes
+    # with its offset, length, first and last time, level mask and, for each
+    # term, the lines it occurs on. Searches by term read just those lines;
+    # other searches read the blocks whose time range and levels can match.
+    # The bytes after the last full block are scanned on every search. A new
+    # inode (rotation) or a shorter file (truncation) starts a new index.
+    def __init__(self, name, path, directory):
+        self.name = name
+        self.path = path
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._reset(None, None)
+
+    def _reset(self, inode, index_inode):
+        self._inode = inode
+        self._index_inode = index_inode
+        self._read = 0
+        self.end = 0
+        self._offsets = array('q')
+        self._lengths = array('L')
+        self._first = []
+        self._last = []
+        self._levels = bytearray()
+        self._postings = {}
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, f'{self.name}.idx')
+
+    def update(self):
+        # Brings the index up to date with the log; returns the log's size.
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset(None, None)
+                return 0
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f'{self.name}.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._load(st)
+                if st.st_size - self.end >= LOG_INDEX_BLOCK:
+                    self._extend(st.st_size)
+            return st.st_size
+
+    def _load(self, st):
+        # Reads the records other processes have appended since the last
+        # call, or starts a new index file if it is for another log file.
+        try:
+            with open(self._index_path, 'r+b') as f:
+                index_inode = os.fstat(f.fileno()).st_ino
+                if index_inode != self._index_inode:
+                    self._reset(None, index_inode)
+                f.seek(self._read)
+                data = f.read()
+                complete = data.rfind(b'\n') + 1
+                for line in data[:complete].splitlines():
+                    record = json.loads(line)
+                    if isinstance(record, dict):
+                        self._inode = record['inode']
+                    else:
+                        self._add(*record)
+                self._read += complete
+                if complete < len(data):
+                    # A record cut short by a crash; the next append replaces it.
+                    f.truncate(self._read)
+        except FileNotFoundError:
+            self._reset(None, None)
+        if self._inode == st.st_ino and self.end <= st.st_size:
+            return
+        header = json.dumps({'path': self.path, 'inode': st.st_ino}) + '\n'
+        atomic_write(self._index_path, [header])
+        self._reset(st.st_ino, os.stat(self._index_path).st_ino)
+        self._read = len(header.encode())
+
+    def _extend(self, size):
+        now = datetime.now()
+        records = []
+        with open(self.path, 'rb') as log:
+            log.seek(self.end)
+            position = self.end
+            while size - position >= LOG_INDEX_BLOCK:
+                data = log.read(LOG_INDEX_BLOCK)
+                while b'\n' not in data and log.tell() < size:
+                    data += log.read(LOG_INDEX_BLOCK)
+                data = data[:data.rfind(b'\n') + 1]
+                if not data:
+                    break
+                log.seek(position + len(data))
+                record = [position, len(data), *summarize_log_block(data, now)]
+                records.append(json.dumps(record) + '\n')
+                self._add(*record)
+                position += len(data)
+        with open(self._index_path, 'ab') as f:
+            f.write(''.join(records).encode())
+            self._read = f.tell()
+
+    def _add(self, offset, length, first, last, levels, postings):
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._first.append(first)
+        self._last.append(last)
+        self._levels.append(levels)
+        for term, lines in postings.items():
+            self._postings.setdefault(sys.intern(term), array('q')).extend(offset + line for line in lines)
+        self.end = offset + length
+
+    def _block_matches(self, block, query):
+        return ((not query.levels or self._levels[block] & query.levels)
+                and (not query.since or self._last[block] >= query.since)
+                and (not query.until or self._first[block] < query.until))
+
+    def _candidates(self, query):
+        # (offset, length) of the indexed lines or blocks that can hold a
+        # match, oldest first. length is None for single lines.
+        if not query.terms:
+            return [(self._offsets[block], self._lengths[block]) for block in range(len(self._offsets))
+                    if self._block_matches(block, query)]
+        postings = sorted((self._postings.get(term, ()) for term in query.terms), key=len)
+        lines = postings[0]
+        if len(postings) > 1:
+            common = set(lines).intersection(*postings[1:])
+            lines = [line for line in lines if line in common]
+        return [(line, None) for line in lines
+                if self._block_matches(bisect_right(self._offsets, line) - 1, query)]
+
+    def search(self, query, limit, before=None):
+        # Matching lines, newest first, starting before byte offset `before`.
+        size = self.update()
+        with self._lock:
+            ranges = self._candidates(query)
+            end = self.end
+        if size > end:
+            ranges.append((end, size - end))
+        now = datetime.now()
+        logs = []
+        offsets = []
+        scanned = 0
+        with open(self.path, 'rb') as f:
+            for offset, length in reversed(ranges):
+                if before is not None and offset >= before:
+                    continue
+                f.seek(offset)
+                if length is None:
+                    lines = [f.readline()]
+                    scanned += len(lines[0])
+                else:
+                    if before is not None:
+                        length = min(length, before - offset)
+                    data = f.read(length)
+                    data = data[:data.rfind(b'\n') + 1]
+                    scanned += len(data)
+                    if query.text and query.text not in data.lower():
+                        continue
+                    lines = data.splitlines(keepends=True)
+                position = offset + sum(len(line) for line in lines)
+                for line in reversed(lines):
+                    position -= len(line)
+                    if line.endswith(b'\n') and self._matches(line, query, now):
+                        logs.append(line.decode('utf-8', errors='replace'))
+                        offsets.append(position)
+                        if len(logs) >= limit:
+                            return {'logs': logs, 'offsets': offsets, 'next': position, 'scanned_bytes': scanned}
+        return {'logs': logs, 'offsets': offsets, 'next': None, 'scanned_bytes': scanned}
+
+    def time_range(self, since, until):
+        # Byte range of the lines timed from `since` (inclusive) to `until`
+        # (exclusive), for a log written in time order.
+        size = self.update()
+        with self._lock:
+            blocks = [(self._offsets[block], self._lengths[block], self._last[block])
+                      for block in range(len(self._offsets))]
+            end = self.end
+        if size > end:
+            blocks.append((end, size - end, None))
+        now = datetime.now()
+        with open(self.path, 'rb') as f:
+            start = self._seek_time(f, blocks, since, now, size) if since else 0
+            stop = self._seek_time(f, [block for block in blocks if block[0] + block[1] > start],
+                                   until, now, size) if until else size
+        return start, max(start, stop)
+
+    @staticmethod
+    def _seek_time(f, blocks, moment, now, default):
+        # Offset of the first line timed at or after `moment`, skipping the
+        # blocks that end before it.
+        for offset, length, last in blocks:
+            if last is not None and last < moment:
+                continue
+            f.seek(offset)
+            position = offset
+            for line in f.read(length).splitlines(keepends=True):
+                match = LOG_LINE_RE.match(line)
+                if match:
+                    time = log_line_fields(match, now)[0]
+                    if time and time >= moment:
+                        return position
+                position += len(line)
+        return default
+
+    @staticmethod
+    def _matches(line, query, now):
+        if query.text and query.text not in line.lower():
+            return False
+        if query.levels or query.since or query.until:
+            match = LOG_LINE_RE.match(line)
+            if not match:
+                return False
+            time, level = log_line_fields(match, now)
+            if query.levels and not log_level_mask(level) & query.levels:
+                return False
+            if query.since and not (time and time >= query.since):
+                return False
+            if query.until and not (time and time < query.until):
+                return False
+        if query.terms:
+            terms = {term for term, _ in log_term_matches(line)}
+            return all(term in terms for term in query.terms)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {'path': self.path, 'indexed_bytes': self.end, 'blocks': len(self._offsets),
+                    'terms': len(self._postings), 'postings': sum(len(lines) for lines in self._postings.values())}
+
+
+log_indexes = {}
+log_indexes_lock = threading.Lock()
+
+
+def get_log_index(source, path):
+    with log_indexes_lock:
+        index = log_indexes.get(source)
+        if index is None or index.path != path:
+            index = log_indexes[source] = LogIndex(source, path, os.path.join(RUN_DIR, 'dhcp_dashboard-logindex'))
+        return index
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def cache_static_files(response):
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+@app.after_request
+def log_request(response):
+    # Also records the request metrics, from the same timing.
+    started = g.pop('request_started', None)
+    if started is not None:
+        latency = (time.perf_counter() - started) * 1000
+        route = request.url_rule.rule if request.url_rule else None
+        labels = (('route', route or 'unmatched'), ('method', request.method))
+        metrics.observe('dhcp_dashboard_http_request_duration_seconds', latency / 1000, labels)
+        metrics.inc('dhcp_dashboard_http_requests_total', labels + (('status', response.status_code),))
+        mac = (request.view_args or {}).get('mac') or request.form.get('mac') or request.args.get('mac')
+        logging.debug(f"{request.method} {request.path} {response.status_code} {latency:.1f}ms",
+                      extra={'route': route, 'method': request.method, 'status': response.status_code,
+                             'mac': mac, 'latency_ms': round(latency, 3)})
+    return response
+
+
+class ProfileNotFound(Exception):
+    pass
+
+
+class ProfileStore:
+    # The slowest profiled requests of all workers, as <id>.prof files in
+    # pstats format plus index.json with the request details. A new profile
+    # is only written if it is slower than the fastest one kept.
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def path(self, profile_id):
+        return os.path.join(self.directory, profile_id + '.prof')
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'profiles.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _save_index(self, profiles):
+        with open(self.index_path + '.tmp', 'w') as f:
+            json.dump(profiles, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def list(self):
+        return sorted(self._load_index(), key=lambda profile: profile['duration_ms'], reverse=True)
+
+    def get(self, profile_id):
+        for profile in self._load_index():
+            if profile['id'] == profile_id:
+                return profile
+        raise ProfileNotFound(f"Profile {profile_id} not found")
+
+    def add(self, record, profiler):
+        with self._locked():
+            profiles = self._load_index()
+            if len(profiles) >= self.keep:
+                fastest = min(profiles, key=lambda profile: profile['duration_ms'])
+                if record['duration_ms'] <= fastest['duration_ms']:
+                    return False
+                profiles.remove(fastest)
+                try:
+                    os.remove(self.path(fastest['id']))
+                except FileNotFoundError:
+                    pass
+            # What cProfile.Profile.dump_stats writes.
+            profiler.create_stats()
+            with open(self.path(record['id']), 'wb') as f:
+                marshal.dump(profiler.stats, f)
+            profiles.append(record)
+            self._save_index(profiles)
+        return True
+
+    def clear(self):
+        with self._locked():
+            for profile in self._load_index():
+                try:
+                    os.remove(self.path(profile['id']))
+                except FileNotFoundError:
+                    pass
+            self._save_index([])
+
+    def report(self, profile_id, sort='cumulative', limit=50):
+        self.get(profile_id)
+        output = io.StringIO()
+        stats = pstats.Stats(self.path(profile_id), stream=output)
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+profile_store = ProfileStore(os.path.join(RUN_DIR, 'dhcp_dashboard-profiles'), PROFILE_KEEP)
+PROFILE_ENDPOINTS = ('static', 'prometheus_metrics', 'api_list_profiles', 'api_download_profile',
+                     'api_clear_profiles')
+# cProfile can only profile one thread at a time, so concurrent requests are
+# not profiled while another one is.
+_profile_lock = threading.Lock()
+
+
+def profile_token_sent():
+    token = request.headers.get('X-Dashboard-Profile', '')
+    return PROFILE_TOKEN is not None and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def start_request_profile():
+    if request.endpoint in PROFILE_ENDPOINTS:
+        return
+    if not PROFILE_REQUESTS and not profile_token_sent():
+        return
+    if not _profile_lock.acquire(blocking=False):
+        return
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    except Exception as e:
+        _profile_lock.release()
+        logging.error(f"Error starting profiler: {str(e)}")
+        return
+    g.profile = (profiler, time.perf_counter())
+
+
+def stop_request_profile():
+    # Returns the profiler and duration of this request if it was profiled.
+    profile = g.pop('profile', None)
+    if profile is None:
+        return None
+    profiler, started = profile
+    profiler.disable()
+    _profile_lock.release()
+    return profiler, time.perf_counter() - started
+
+
+def save_request_profile(response):
+    profile = stop_request_profile()
+    if profile is None:
+        return response
+    profiler, duration = profile
+    record = {
+        'id': uuid.uuid4().hex[:12],
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'pid': os.getpid(),
+    }
+    try:
+        if profile_store.add(record, profiler):
+            response.headers['X-Profile-Id'] = record['id']
+    except Exception as e:
+        logging.error(f"Error saving request profile: {str(e)}")
+    return response
+
+
+def discard_request_profile(error=None):
+    # Requests that raised skip after_request; stop their profiler here.
+    stop_request_profile()
+
+
+# With profiling off the hooks are not registered at all, so requests pay
+# nothing for it.
+if PROFILE_REQUESTS or PROFILE_TOKEN:
+    app.before_request(start_request_profile)
+    app.after_request(save_request_profile)
+    app.teardown_request(discard_request_profile)
+
+
+HOST_SORT_FIELDS = ('mac', 'hostname', 'ip')
+
+
+def host_sort_key(field):
+    if field == 'ip':
+        return lambda host: (tuple(int(part) for part in host.ip.split('.')) if host.ip else (), host.mac)
+    index = HOST_SORT_FIELDS.index(field)
+    return lambda host: (host[index].lower(), host.mac)
+
+
+def encode_cursor(key):
+    return urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    key = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    return tuple(tuple(part) if isinstance(part, list) else part for part in key)
+
+
+def filter_hosts(hosts, args):
+    mac = args.get('mac', '').lower()
+    hostname = args.get('hostname', '').lower()
+    ip = args.get('ip', '')
+    q = args.get('q', '').lower()
+    if not (mac or hostname or ip or q):
+        return hosts
+    return hosts.filter(mac, hostname, ip, q)
+
+
+def query_hosts(hosts, args):
+    # Filters, sorts and pages a host list; returns the page, the filtered
+    # total and a cursor for the next page when sorting is in effect.
+    hosts = filter_hosts(hosts, args)
+    total = len(hosts)
+    sort = args.get('sort', '')
+    cursor = args.get('cursor')
+    limit = args.get('limit', type=int)
+    offset = max(args.get('offset', default=0, type=int), 0)
+    key = None
+
+    if sort or cursor:
+        field = sort.lstrip('-') or 'mac'
+        if field not in HOST_SORT_FIELDS:
+            raise ValueError('Unknown sort field')
+        descending = sort.startswith('-')
+        key = host_sort_key(field)
+        hosts = hosts.sorted(field, descending)
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+                if descending:
+                    offset = len(hosts) - bisect_left(hosts[::-1], position, key=key)
+                else:
+                    offset = bisect_right(hosts, position, key=key)
+            except (TypeError, ValueError):
+                raise ValueError('Invalid cursor')
+
+    end = offset + max(limit, 0) if limit is not None else len(hosts)
+    page = hosts[offset:end]
+    next_cursor = encode_cursor(key(page[-1])) if key and page and end < len(hosts) else None
+    return page, total, next_cursor
+
+
+def hosts_etag(signature, query_string):
+    # The validator covers both the config version and the query, so each
+    # filtered/paginated view revalidates independently.
+    etag = config_etag(signature)
+    if query_string:
+        etag += f'-{zlib.crc32(query_string):08x}'
+    return etag
+
+
+def hosts_last_modified(signature):
+    return datetime.fromtimestamp(signature[3] // 10 ** 9, timezone.utc) if signature else None
+
+
+def host_to_dict(host):
+    mac, hostname, ip = host
+    return {'mac': mac, 'hostname': hostname, 'ip': ip}
+
+
+_brotli = None
+
+
+def brotli_module():
+    # brotli is optional; without it responses are only gzip-compressed.
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli or None
+
+
+def negotiate_encoding(accept_encodings):
+    # The content coding to send for a parsed Accept-Encoding header.
+    offers = ('br', 'gzip') if brotli_module() else ('gzip',)
+    return accept_encodings.best_match(offers, default='identity')
+
+
+def compress_body(body, encoding):
+    # Returns the body in `encoding` and the coding actually used; small
+    # bodies are sent as they are.
+    if encoding == 'identity' or len(body) < COMPRESS_MIN_SIZE:
+        return body, 'identity'
+    if encoding == 'br':
+        return brotli_module().compress(body, quality=BROTLI_QUALITY), 'br'
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), 'gzip'
+
+
+def compress_stream(chunks, encoding):
+    # Compresses an iterator of byte chunks as it is read.
+    if encoding == 'identity':
+        yield from chunks
+        return
+    if encoding == 'br':
+        compressor = brotli_module().Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+class HostListCache:
+    # The unfiltered GET /api/hosts body for one host store and config
+    # version, serialized once and compressed at most once per content
+    # coding, so repeated requests only copy bytes. A write gives a new ETag,
+    # and re-reading the file a new store, either of which replaces it.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._bodies = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, store, etag, encoding):
+        # Returns the body and the content coding it is in.
+        key = (weakref.ref(store), etag)
+        with self._lock:
+            if key != self._key:
+                self._key = key
+                self._bodies = {}
+            body = self._bodies.get(encoding)
+            identity = self._bodies.get('identity')
+            if body:
+                self.hits += 1
+                return body
+            self.misses += 1
+        if identity is None:
+            identity = (store.view().to_json().encode(), 'identity')
+        body = compress_body(identity[0], encoding)
+        with self._lock:
+            if key == self._key:
+                self._bodies['identity'] = identity
+                self._bodies[encoding] = body
+        return body
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'encodings': sorted(self._bodies),
+                'bytes': sum(len(body) for body, _ in self._bodies.values()),
+            }
+
+
+host_list_cache = HostListCache()
+
+
+def host_list_body(store, etag, args, encoding):
+    # The GET /api/hosts response for both servers as (content, mimetype,
+    # headers). content is bytes, or for ?format=ndjson an iterator of
+    # chunks. The unfiltered JSON list comes from host_list_cache.
+    body_format = args.get('format', 'json')
+    if body_format not in ('json', 'ndjson'):
+        raise ValueError('Unknown format')
+    headers = {'Vary': 'Accept-Encoding'}
+    if body_format == 'json' and all(name == 'format' for name in args):
+        content, encoding = host_list_cache.get(store, etag, encoding)
+        headers['X-Total-Count'] = str(len(store))
+    else:
+        hosts, total, next_cursor = query_hosts(store.view(), args)
+        headers['X-Total-Count'] = str(total)
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+        if body_format == 'ndjson':
+            content = compress_stream(hosts.ndjson_chunks(), encoding)
+        else:
+            content, encoding = compress_body(hosts.to_json().encode(), encoding)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return content, 'application/x-ndjson' if body_format == 'ndjson' else 'application/json', headers
+
+
+@app.route('/api/hosts', methods=['GET'])
+def api_get_hosts():
+    store, signature = load_host_snapshot()
+    etag = hosts_etag(signature, request.query_string)
+    last_modified = hosts_last_modified(signature)
+
+    if request.if_none_match:
+        matched = matching_etag(request.if_none_match, etag)
+    else:
+        matched = etag if (last_modified and request.if_modified_since
+                           and last_modified <= request.if_modified_since) else None
+    if matched:
+        response = Response(status=304)
+        response.set_etag(matched)
+    else:
+        try:
+            content, mimetype, headers = host_list_body(store, etag, request.args,
+                                                        negotiate_encoding(request.accept_encodings))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response = Response(content, mimetype=mimetype, headers=headers)
+        response.set_etag(coded_etag(etag, headers.get('Content-Encoding', 'identity')))
+
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def api_result(body, status, etag=None):
+    response = jsonify(body)
+    if etag:
+        response.set_etag(etag)
+    return response, status
+
+
+def add_host_from_api(data, if_match):
+    # Shared by the Flask view and the asyncio API; returns the response
+    # body, status code and ETag.
+    if not isinstance(data, dict):
+        return {'error': 'Expected a JSON object'}, 400, None
+    if 'mac' not in data or 'hostname' not in data:
+        return {'error': 'Missing required fields'}, 400, None
+
+    mac = data['mac']
+    hostname = data['hostname']
+    ip = data.get('ip') or None
+    error = validate_host(mac, hostname, ip)
+    if error:
+        return {'error': error}, 400, None
+    mac = normalize_mac(mac)
+
+    try:
+        with host_transaction(if_match) as transaction:
+            store = transaction.store
+            conflict = store.conflict(mac, hostname, ip)
+            if conflict:
+                return {'error': CONFLICT_MESSAGES[conflict]}, 400, None
+
+            host = store.add((mac, hostname, ip))
+            save_host_changes(store, added=[host])
+        generation = schedule_dnsmasq_apply()
+    except PreconditionFailed as e:
+        return {'error': str(e)}, 412, e.etag
+    except Exception as e:
+        logging.error(f"Error adding host via API: {str(e)}")
+        return {'error': 'Failed to add host'}, 500, None
+
+    return {'message': 'Host added successfully', 'reload': generation}, 201, transaction.etag
+
+
+def remove_host_from_api(mac, if_match):
+    try:
+        with host_transaction(if_match) as transaction:
+            store = transaction.store
+            host = store.remove(mac)
+            if host is None:
+                return {'error': 'Host not found'}, 404, None
+
+            save_host_changes(store, removed=[host])
+        generation = schedule_dnsmasq_apply()
+    except PreconditionFailed as e:
+        return {'error': str(e)}, 412, e.etag
+    except Exception as e:
+        logging.error(f"Error removing host via API: {str(e)}")
+        return {'error': 'Failed to remove host'}, 500, None
+
+    return {'message': 'Host removed successfully', 'reload': generation}, 200, transaction.etag
+
+
+@app.route('/api/hosts', methods=['POST'])
+def api_add_host():
+    return api_result(*add_host_from_api(request.json, if_match_header()))
+
+
+@app.route('/api/hosts/<mac>', methods=['DELETE'])
+def api_remove_host(mac):
+    return api_result(*remove_host_from_api(mac, if_match_header()))
+
+
+BULK_CSV_FIELDS = ['mac', 'hostname', 'ip']
 
-logging.basicConfig(filename='dhcp_dashboard.log', level=logging.DEBUG)
 
+def read_bulk_rows():
+    # Yields (row number, row dict or None, parse error or None) for JSON
+    # arrays, NDJSON streams and CSV bodies.
+    mimetype = request.mimetype
+    if mimetype in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        for number, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line), None
+            except ValueError:
+                yield number, None, 'Invalid JSON'
+    elif mimetype == 'text/csv':
+        reader = csv.reader(io.TextIOWrapper(request.stream, encoding='utf-8', newline=''))
+        for number, fields in enumerate(reader, 1):
+            if not fields or (number == 1 and fields[0].strip().lower() == 'mac'):
+                continue
+            yield number, dict(zip(BULK_CSV_FIELDS, (field.strip() for field in fields))), None
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('hosts')
+        if not isinstance(data, list):
+            raise ValueError('Expected a JSON array of hosts')
+        for number, row in enumerate(data, 1):
+            yield number, row, None
 
-def read_dhcp_hosts():
+
+def apply_bulk_hosts(rows, upsert, partial, if_match=None):
+    # Validates every row against the indexed store plus the rows before it,
+    # then applies the valid ones as a single write.
+    with host_transaction(if_match) as transaction:
+        store = transaction.store
+        errors = []
+        planned = []
+        claimed = {'mac': set(), 'hostname': set(), 'ip': set()}
+        unchanged = 0
+
+        for number, row, error in rows:
+            if error is None and not isinstance(row, dict):
+                error = 'Expected an object with mac, hostname and ip'
+            if error is None:
+                mac, hostname, ip = row.get('mac'), row.get('hostname'), row.get('ip') or None
+                error = validate_host(mac, hostname, ip)
+            if error is None:
+                mac = normalize_mac(mac)
+                current = store.get(mac)
+                if current and not upsert:
+                    error = CONFLICT_MESSAGES['mac']
+                elif current and current == (mac, hostname, ip or ''):
+                    unchanged += 1
+                    continue
+                else:
+                    field = store.conflict(mac, hostname, ip, ignore_mac=mac)
+                    for name, value in (('mac', mac), ('hostname', hostname.lower()), ('ip', ip)):
+                        if field is None and value and value in claimed[name]:
+                            field = name
+                    if field:
+                        error = CONFLICT_MESSAGES[field]
+            if error:
+                errors.append({'row': number, 'mac': row.get('mac') if isinstance(row, dict) else None,
+                               'error': error})
+                continue
+            claimed['mac'].add(mac)
+            claimed['hostname'].add(hostname.lower())
+            if ip:
+                claimed['ip'].add(ip)
+            planned.append((current, Host(mac, hostname, ip or '')))
+
+        result = {'added': 0, 'updated': 0, 'unchanged': unchanged, 'errors': errors, 'applied': False}
+        if not planned or (errors and not partial):
+            return result, transaction
+
+        added, removed = [], []
+        for current, host in planned:
+            if current:
+                removed.append(current)
+                added.append(store.replace(current.mac, host))
+                result['updated'] += 1
+            else:
+                added.append(store.add(host))
+                result['added'] += 1
+        save_host_changes(store, added=added, removed=removed)
+        result['applied'] = True
+        result['reload'] = schedule_dnsmasq_apply()
+        logging.info(f"Bulk import: {result['added']} added, {result['updated']} updated, {len(errors)} rejected")
+    return result, transaction
+
+
+@app.route('/api/hosts/bulk', methods=['POST', 'PUT'])
+def api_bulk_hosts():
+    upsert = request.method == 'PUT'
+    partial = request.args.get('partial', default=0, type=int) == 1
     try:
-        with open(DNSMASQ_CONF, 'r') as f:
-            content = f.read()
-        hosts = re.findall(r'dhcp-host=([\w:]+),([\w.-]+)(?:,([\d.]+))?', content)
-        logging.info(f"Read {len(hosts)} hosts from configuration")
-        return hosts
+        result, transaction = apply_bulk_hosts(read_bulk_rows(), upsert, partial, if_match_header())
+    except PreconditionFailed as e:
+        return precondition_failed_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logging.error(f"Error reading DHCP hosts: {str(e)}")
-        return []
+        logging.error(f"Error importing hosts via API: {str(e)}")
+        return jsonify({'error': 'Failed to import hosts'}), 500
 
+    response = jsonify(result)
+    response.set_etag(transaction.etag)
+    if result['errors'] and not result['applied']:
+        return response, 400
+    return response, 200
 
-def write_dhcp_hosts(hosts):
+
+@app.route('/api/hosts/export', methods=['GET'])
+def api_export_hosts():
+    export_format = request.args.get('format', 'ndjson')
+    hosts = load_host_store().view()
+
+    def generate_ndjson():
+        return hosts.ndjson_chunks()
+
+    def generate_json():
+        yield b'['
+        for index, chunk in enumerate(hosts.ndjson_chunks()):
+            yield (b',' if index else b'') + chunk[:-1].replace(b'\n', b',')
+        yield b']\n'
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(BULK_CSV_FIELDS)
+        for host in hosts:
+            writer.writerow(host)
+            if buffer.tell() > 65536:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode()
+
+    generators = {
+        'ndjson': (generate_ndjson, 'application/x-ndjson'),
+        'json': (generate_json, 'application/json'),
+        'csv': (generate_csv, 'text/csv'),
+    }
+    if export_format not in generators:
+        return jsonify({'error': 'Unknown export format'}), 400
+    generate, mimetype = generators[export_format]
+    encoding = negotiate_encoding(request.accept_encodings)
+    response = Response(compress_stream(generate(), encoding), mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def lease_to_dict(lease, store, now):
+    reservation = store.get(lease.mac) if lease.mac else None
+    return {
+        'mac': lease.mac,
+        'ip': lease.ip,
+        'hostname': lease.hostname,
+        'client_id': lease.client_id,
+        'expires': datetime.fromtimestamp(lease.expires).isoformat() if lease.expires else None,
+        'active': lease.expires == 0 or lease.expires > now,
+        'reservation': {'hostname': reservation.hostname, 'ip': reservation.ip} if reservation else None,
+    }
+
+
+@app.route('/api/leases', methods=['GET'])
+def api_get_leases():
+    limit = min(max(request.args.get('limit', default=100, type=int), 0), 1000)
+    offset = max(request.args.get('offset', default=0, type=int), 0)
+    mac = request.args.get('mac', '').lower()
+    ip = request.args.get('ip', '')
+    hostname = request.args.get('hostname', '').lower()
+    state = request.args.get('state')
+    reserved = request.args.get('reserved')
+
+    table = load_leases()
+    store = load_host_store()
+    now = time.time()
+
+    # A complete MAC or IP address is looked up in the index; anything
+    # shorter is a prefix filter over the table.
+    if mac and MAC_RE.match(normalize_mac(mac)):
+        lease = table.get(mac)
+        candidates = [lease] if lease else []
+        mac = ''
+    elif ip and ip.count('.') == 3 and ip.split('.')[-1]:
+        lease = table.find_by_ip(ip)
+        candidates = [lease] if lease else []
+        ip = ''
+    else:
+        candidates = table.leases
+
+    def matches(lease):
+        if mac and not (lease.mac or '').lower().startswith(mac):
+            return False
+        if ip and not lease.ip.startswith(ip):
+            return False
+        if hostname and hostname not in (lease.hostname or '').lower():
+            return False
+        if state and (lease.expires == 0 or lease.expires > now) != (state == 'active'):
+            return False
+        if reserved and (lease.mac is not None and lease.mac in store) != (reserved == 'true'):
+            return False
+        return True
+
+    if mac or ip or hostname or state or reserved:
+        candidates = [lease for lease in candidates if matches(lease)]
+
+    page = candidates[offset:offset + limit]
+    return jsonify({
+        'total': len(candidates),
+        'offset': offset,
+        'limit': limit,
+        'leases': [lease_to_dict(lease, store, now) for lease in page],
+    })
+
+
+def submit_job_response(kind, fn, *args, key=None, timeout=None):
     try:
-        with open(DNSMASQ_CONF, 'r') as f:
-            content = f.readlines()
+        job, created = job_manager.submit(kind, fn, *args, key=key, timeout=timeout)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    response = jsonify(job.to_dict())
+    response.headers['Location'] = url_for('api_get_job', job_id=job.id)
+    return response, 202
 
-        new_content = [line for line in content if not line.startswith('dhcp-host=')]
-        for mac, hostname, ip in hosts:
-            if ip:
-                new_content.append(f'dhcp-host={mac},{hostname},{ip}\n')
-            else:
-                new_content.append(f'dhcp-host={mac},{hostname}\n')
 
-        with open(DNSMASQ_CONF, 'w') as f:
-            f.writelines(new_content)
+@app.route('/api/jobs', methods=['GET'])
+def api_list_jobs():
+    return jsonify(job_manager.list(limit=min(request.args.get('limit', default=20, type=int), JOB_HISTORY)))
 
-        logging.info(f"Wrote {len(hosts)} hosts to configuration")
-    except Exception as e:
-        logging.error(f"Error writing DHCP hosts: {str(e)}")
-        raise
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
-def restart_dnsmasq():
+
+@app.route('/api/dnsmasq/restart', methods=['POST'])
+def api_restart_dnsmasq():
+    return submit_job_response('restart', restart_dnsmasq_job, key='dnsmasq-restart', timeout=SUBPROCESS_TIMEOUT)
+
+
+@app.route('/api/wifi', methods=['POST'])
+def api_update_wifi():
+    data = request.json
+    if not data or not data.get('ssid') or not data.get('password'):
+        return jsonify({'error': 'Missing required fields'}), 400
+    return submit_job_response('wifi', wifi_job, data['ssid'], data['password'], key='wifi', timeout=120)
+
+
+@app.route('/api/dnsmasq/reload', methods=['GET'])
+def api_reload_status():
+    return jsonify(reload_scheduler.status())
+
+
+@app.route('/api/dnsmasq/reload', methods=['POST'])
+def api_schedule_reload():
+    action = request.args.get('action', 'reload')
+    if action not in ReloadScheduler.ACTIONS:
+        return jsonify({'error': 'Unknown action'}), 400
+    generation = reload_scheduler.schedule(action)
+    return jsonify({'message': f'DNSMASQ {action} scheduled', 'reload': generation}), 202
+
+
+@app.route('/api/status', methods=['GET'])
+def api_dnsmasq_status():
+    # Served from the monitor's last check; 503 lets health checks use the
+    # status code alone.
+    status = status_monitor.get()
+    status.pop('checked_at', None)
+    status['reload'] = reload_scheduler.status()
+    return jsonify(status), 200 if status['active_state'] == 'active' else 503
+
+
+def backup_summary(snapshot):
+    return {
+        'id': snapshot['id'],
+        'created': snapshot['created'],
+        'reason': snapshot['reason'],
+        'files': [{'path': path, 'sha256': entry['sha256'], 'size': entry['size']}
+                  for path, entry in snapshot['files'].items()],
+    }
+
+
+@app.route('/api/backups', methods=['GET'])
+def api_list_backups():
     try:
-        result = subprocess.run(['sudo', 'systemctl', 'restart', 'dnsmasq'], capture_output=True, text=True)
-        if result.returncode != 0:
-            status_output = get_dnsmasq_status()
-            logging.error(f"Error restarting DNSMASQ: {result.stderr}\nStatus: {status_output}")
-            raise Exception(f"Failed to restart DNSMASQ. Status: {status_output}")
-        logging.info("DNSMASQ restarted successfully")
+        return jsonify([backup_summary(snapshot) for snapshot in backup_store.list()])
     except Exception as e:
-        logging.error(f"Exception when restarting DNSMASQ: {str(e)}")
-        raise
+        logging.error(f"Error listing backups: {str(e)}")
+        return jsonify({'error': 'Failed to list backups'}), 500
+
 
+@app.route('/api/backups', methods=['POST'])
+def api_create_backup():
+    return submit_job_response('backup', backup_job, key='backup', timeout=SUBPROCESS_TIMEOUT)
 
-def get_dnsmasq_status():
+
+@app.route('/api/backups/<snapshot_id>/diff', methods=['GET'])
+def api_diff_backup(snapshot_id):
     try:
-        result = subprocess.run(['sudo', 'systemctl', 'status', 'dnsmasq'], capture_output=True, text=True)
-        return result.stdout
+        diff = backup_store.diff(snapshot_id, request.args.get('against'))
+    except BackupNotFound as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
-        logging.error(f"Error getting DNSMASQ status: {str(e)}")
-        return "Unable to get DNSMASQ status"
+        logging.error(f"Error comparing backup {snapshot_id}: {str(e)}")
+        return jsonify({'error': 'Failed to compare backup'}), 500
+    return Response(diff, mimetype='text/plain')
 
 
-def backup_dnsmasq_conf():
+@app.route('/api/backups/<snapshot_id>/restore', methods=['POST'])
+def api_restore_backup(snapshot_id):
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = f"{DNSMASQ_CONF}.backup_{timestamp}"
-        shutil.copy2(DNSMASQ_CONF, backup_file)
-        logging.info(f"Backup created: {backup_file}")
-        return backup_file
+        restored, transaction = backup_store.restore(snapshot_id, if_match_header())
+    except BackupNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except PreconditionFailed as e:
+        return precondition_failed_response(e)
     except Exception as e:
-        logging.error(f"Error creating backup: {str(e)}")
-        raise
+        logging.error(f"Error restoring backup {snapshot_id}: {str(e)}")
+        return jsonify({'error': 'Failed to restore backup'}), 500
 
+    generation = None
+    if DNSMASQ_CONF in restored:
+        generation = reload_scheduler.schedule('restart')
+    elif restored:
+        generation = schedule_dnsmasq_apply()
+    response = jsonify({'message': f'Backup {snapshot_id} restored', 'restored': restored, 'reload': generation})
+    response.set_etag(transaction.etag)
+    return response
 
-def shutdown_pi():
-    os.system("sudo shutdown -h now")
 
+def config_entry_to_dict(entry):
+    data = entry._asdict()
+    data.pop('tokens', None)
+    data.pop('comment', None)
+    source = data.pop('source')
+    data['source'] = {'path': source.path, 'line': source.line}
+    return data
 
-def update_wifi_settings(ssid, password):
-    try:
-        wpa_config = f'''
-                ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev
-                update_config=1
-                country=BE
 
-                network={{
-                    ssid="{ssid}"
-                    psk="{password}"
-                }}
-        '''
-        with open(WPA_SUPPLICANT_CONF, 'w') as f:
-            f.write(wpa_config)
+@app.route('/api/config', methods=['GET'])
+def api_get_config():
+    try:
+        config = config_cache.get(DNSMASQ_CONF, parse_dnsmasq_config)
+    except Exception as e:
+        logging.error(f"Error reading DNSMASQ configuration: {str(e)}")
+        return jsonify({'error': 'Failed to read configuration'}), 500
+    return jsonify({
+        'files': list(config.dependencies),
+        'ranges': [config_entry_to_dict(entry) for entry in config.ranges],
+        'hosts': [config_entry_to_dict(entry) for entry in config.hosts],
+        'addresses': [config_entry_to_dict(entry) for entry in config.addresses],
+        'host_records': [config_entry_to_dict(entry) for entry in config.host_records],
+        'includes': [config_entry_to_dict(entry) for entry in config.includes],
+        'options': [config_entry_to_dict(entry) for entry in config.options],
+    })
 
-        # Restart the Wi-Fi interface
-        subprocess.run(['sudo', 'ifconfig', 'wlan0', 'down'], check=True)
-        time.sleep(1)
-        subprocess.run(['sudo', 'ifconfig', 'wlan0', 'up'], check=True)
-        time.sleep(2)
-        subprocess.run(['sudo', 'wpa_cli', '-i', 'wlan0', 'reconfigure'], check=True)
 
-        # Wait for the connection to be established
-        for _ in range(30):  # Wait up to 30 seconds
-            result = subprocess.run(['iwgetid', '-r'], capture_output=True, text=True)
-            if result.stdout.strip() == ssid:
-                logging.info(f"Successfully connected to Wi-Fi network: {ssid}")
-                return True
-            time.sleep(1)
+@app.route('/api/cache', methods=['GET'])
+def api_cache_stats():
+    return jsonify({'hosts': host_cache.stats(), 'leases': lease_cache.stats(), 'config': config_cache.stats(),
+                    'host_list': host_list_cache.stats()})
 
-        logging.error(f"Failed to connect to Wi-Fi network: {ssid}")
-        return False
-    except Exception as e:
-        logging.error(f"Error updating Wi-Fi settings: {str(e)}")
-        return False
 
+def metrics_snapshot():
+    snapshot = metrics.snapshot()
+    for cache in (host_cache, lease_cache, config_cache):
+        stats = cache.stats()
+        snapshot['counters'].append(['dhcp_dashboard_cache_hits_total', [['cache', cache.name]], stats['hits']])
+        snapshot['counters'].append(['dhcp_dashboard_cache_misses_total', [['cache', cache.name]], stats['misses']])
+    return snapshot
 
-@app.route('/api/hosts', methods=['GET'])
-def api_get_hosts():
-    hosts = read_dhcp_hosts()
-    return jsonify([{'mac': mac, 'hostname': hostname, 'ip': ip} for mac, hostname, ip in hosts])
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    counters, histograms = metrics.collect()
+    gauges = {('dhcp_dashboard_hosts', ()): len(load_host_store())}
+    status = status_monitor.get()
+    if status['checked_at'] is not None:
+        gauges[('dhcp_dashboard_dnsmasq_up', ())] = 1 if status['active_state'] == 'active' else 0
+    for name, path in log_sources().items():
+        try:
+            gauges[('dhcp_dashboard_log_file_bytes', (('log', name),))] = os.path.getsize(path)
+        except OSError:
+            pass
+    return Response(format_metrics(counters, histograms, gauges), mimetype='text/plain; version=0.0.4')
 
-@app.route('/api/hosts', methods=['POST'])
-def api_add_host():
-    data = request.json
-    if not data or 'mac' not in data or 'hostname' not in data:
-        return jsonify({'error': 'Missing required fields'}), 400
 
-    mac = data['mac']
-    hostname = data['hostname']
-    ip = data.get('ip')
+def profile_access_error():
+    if not PROFILE_REQUESTS and not PROFILE_TOKEN:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    if PROFILE_TOKEN and not profile_token_sent():
+        return jsonify({'error': 'Send the profiling token in the X-Dashboard-Profile header'}), 403
+    return None
 
-    hosts = read_dhcp_hosts()
-    if any(h[0] == mac for h in hosts):
-        return jsonify({'error': 'MAC address already exists'}), 400
-    if any(h[1] == hostname for h in hosts):
-        return jsonify({'error': 'Hostname already exists'}), 400
 
-    hosts.append((mac, hostname, ip))
+@app.route('/api/profiles', methods=['GET'])
+def api_list_profiles():
+    error = profile_access_error()
+    if error:
+        return error
     try:
-        write_dhcp_hosts(hosts)
-        restart_dnsmasq()
-        return jsonify({'message': 'Host added successfully'}), 201
+        return jsonify(profile_store.list())
     except Exception as e:
-        logging.error(f"Error adding host via API: {str(e)}")
-        return jsonify({'error': 'Failed to add host'}), 500
+        logging.error(f"Error listing profiles: {str(e)}")
+        return jsonify({'error': 'Failed to list profiles'}), 500
 
 
-@app.route('/api/hosts/<mac>', methods=['DELETE'])
-def api_remove_host(mac):
-    hosts = read_dhcp_hosts()
-    original_count = len(hosts)
-    hosts = [h for h in hosts if h[0] != mac]
-    if len(hosts) == original_count:
-        return jsonify({'error': 'Host not found'}), 404
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def api_download_profile(profile_id):
+    error = profile_access_error()
+    if error:
+        return error
+    try:
+        if request.args.get('format') == 'text':
+            report = profile_store.report(profile_id, request.args.get('sort', 'cumulative'),
+                                          request.args.get('limit', default=50, type=int))
+            return Response(report, mimetype='text/plain')
+        profile_store.get(profile_id)
+        return send_file(profile_store.path(profile_id), mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f'{profile_id}.prof')
+    except ProfileNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except KeyError:
+        return jsonify({'error': 'Unknown sort key'}), 400
+    except Exception as e:
+        logging.error(f"Error reading profile {profile_id}: {str(e)}")
+        return jsonify({'error': 'Failed to read profile'}), 500
+
 
+@app.route('/api/profiles', methods=['DELETE'])
+def api_clear_profiles():
+    error = profile_access_error()
+    if error:
+        return error
     try:
-        write_dhcp_hosts(hosts)
-        restart_dnsmasq()
-        return jsonify({'message': 'Host removed successfully'}), 200
+        profile_store.clear()
     except Exception as e:
-        logging.error(f"Error removing host via API: {str(e)}")
-        return jsonify({'error': 'Failed to remove host'}), 500
+        logging.error(f"Error removing profiles: {str(e)}")
+        return jsonify({'error': 'Failed to remove profiles'}), 500
+    return jsonify({'message': 'Profiles removed'})
 
 
 @app.route('/api/logs', methods=['GET'])
 def api_get_logs():
     lines = request.args.get('lines', default=50, type=int)
+    after = request.args.get('after', type=int)
+    if lines < 1:
+        return jsonify({'error': 'lines must be at least 1'}), 400
     try:
-        with open(LOG_FILE, 'r') as file:
-            log_contents = file.readlines()
-
-        # Get the last 'lines' number of log entries
-        last_logs = log_contents[-lines:]
-
-        return jsonify({'logs': last_logs})
+        if after is not None:
+            logs, offset = read_log_lines_after(LOG_FILE, max(after, 0), lines)
+        else:
+            logs, offset = tail_log_segments(LOG_FILE, lines)
+        return jsonify({'logs': logs, 'offset': offset})
     except Exception as e:
         logging.error(f"Error reading log file: {str(e)}")
         return jsonify({'error': 'Failed to read log file'}), 500
 
 
+def log_sources():
+    return {'dashboard': LOG_FILE, 'dnsmasq': DNSMASQ_LOG_FILE}
+
+
+def search_logs_from_api(args):
+    # Shared by the Flask view and the asyncio API; returns the response
+    # body and status code.
+    sources = log_sources()
+    source = args.get('source', 'dashboard')
+    if source not in sources:
+        return {'error': 'Unknown log source'}, 400
+    try:
+        query = parse_log_query(args)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    try:
+        limit = min(max(int(args.get('limit', 100)), 1), LOG_SEARCH_LIMIT)
+        before = int(args['before']) if args.get('before') else None
+    except ValueError:
+        return {'error': 'limit and before must be integers'}, 400
+    try:
+        return get_log_index(source, sources[source]).search(query, limit, before), 200
+    except Exception as e:
+        logging.error(f"Error searching log file: {str(e)}")
+        return {'error': 'Failed to search log file'}, 500
+
+
+@app.route('/api/logs/search', methods=['GET'])
+def api_search_logs():
+    body, status = search_logs_from_api(request.args)
+    return jsonify(body), status
+
+
+def sse(lines):
+    return ''.join('data: ' + line.rstrip('\r\n') + '\n\n' for line in lines)
+
+
+@app.route('/api/logs/stream', methods=['GET'])
+def api_stream_logs():
+    sources = log_sources()
+    source = request.args.get('source', 'dashboard')
+    if source not in sources:
+        return jsonify({'error': 'Unknown log source'}), 400
+    path = sources[source]
+    backlog = request.args.get('lines', default=0, type=int)
+
+    def generate():
+        subscription = get_log_follower(path).subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            if backlog > 0:
+                try:
+                    yield sse(tail_log_lines(path, backlog)[0])
+                except OSError:
+                    pass
+            while True:
+                lines, dropped = subscription.get(LOG_STREAM_HEARTBEAT)
+                if lines:
+                    yield sse(lines)
+                if dropped:
+                    yield f'event: dropped\ndata: {dropped}\n\n'
+                if not lines and not dropped:
+                    yield ': keepalive\n\n'
+        finally:
+            get_log_follower(path).unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def read_file_chunks(f, start, end):
+    f.seek(start)
+    while start < end:
+        chunk = f.read(min(LOG_DOWNLOAD_CHUNK, end - start))
+        if not chunk:
+            break
+        start += len(chunk)
+        yield chunk
+
+
+def slice_log_lines(f, since, until):
+    # Lines of a log timed from `since` to `until`, in chunks. Untimed lines
+    # (tracebacks) go with the line before them.
+    now = datetime.now()
+    keep = False
+    lines = []
+    size = 0
+    for line in f:
+        match = LOG_LINE_RE.match(line)
+        time = log_line_fields(match, now)[0] if match else None
+        if time:
+            if until and time >= until:
+                break
+            keep = not since or time >= since
+        if keep:
+            lines.append(line)
+            size += len(line)
+            if size >= LOG_DOWNLOAD_CHUNK:
+                yield b''.join(lines)
+                lines = []
+                size = 0
+    if lines:
+        yield b''.join(lines)
+
+
+def log_segment_chunks(source, path, size, live, since, until):
+    # One log segment, or its lines from `since` to `until`. The live log is
+    # sliced with its search index and read up to `size`, rotated segments
+    # are scanned.
+    if live:
+        start, end = get_log_index(source, path).time_range(since, until) if since or until else (0, size)
+        with open(path, 'rb') as f:
+            yield from read_file_chunks(f, start, min(end, size))
+    else:
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+            yield from slice_log_lines(f, since, until)
+
+
+def log_archive_chunks(source, segments, since, until):
+    # Segments oldest first as one gzip file of several members, which
+    # gunzip and zcat turn back into the concatenated log. Whole .gz
+    # segments are copied as they are; the others are compressed here.
+    for path, st, live in segments:
+        if path.endswith('.gz') and not (since or until):
+            with open(path, 'rb') as f:
+                yield from read_file_chunks(f, 0, st.st_size)
+        else:
+            yield from compress_stream(log_segment_chunks(source, path, st.st_size, live, since, until), 'gzip')
+
+
+def log_download_body(args, encoding):
+    # The GET /api/logs/download response for both servers as (content,
+    # mimetype, filename, headers, etag, last_modified). content is an
+    # iterator of chunks, or the path of the live log when all of it is sent
+    # as it is, which send_file and FileResponse do with Range support. ?since= and
+    # ?until= select a time window; ?segments=all adds the rotated segments
+    # and returns a .gz file.
+    sources = log_sources()
+    source = args.get('source', 'dashboard')
+    if source not in sources:
+        raise ValueError('Unknown log source')
+    path = sources[source]
+    since = parse_log_time(args.get('since'))
+    until = parse_log_time(args.get('until'))
+    if args.get('segments', 'current') not in ('current', 'all'):
+        raise ValueError('segments must be current or all')
+    archive = args.get('segments') == 'all'
+    segments = [(path, os.stat(path), True)]
+    if archive:
+        for segment in log_segments(path)[1:]:
+            try:
+                st = os.stat(segment)
+            except FileNotFoundError:
+                continue
+            # A segment last written before the window holds none of it.
+            if not since or datetime.fromtimestamp(st.st_mtime).isoformat(timespec='milliseconds') >= since:
+                segments.insert(0, (segment, st, False))
+    signature = ';'.join(f'{st.st_ino}-{st.st_size}-{st.st_mtime_ns}' for _, st, _ in segments)
+    etag = hashlib.sha1(f'{signature};{since};{until}'.encode()).hexdigest()[:16]
+    last_modified = datetime.fromtimestamp(int(max(st.st_mtime for _, st, _ in segments)), timezone.utc)
+    filename = os.path.basename(path)
+    headers = {'Vary': 'Accept-Encoding'}
+    if archive:
+        content = log_archive_chunks(source, segments, since, until)
+        return content, 'application/gzip', filename + '.gz', headers, etag + '-archive', last_modified
+    if not (since or until) and encoding == 'identity':
+        return path, 'text/plain', filename, headers, etag, last_modified
+    content = compress_stream(log_segment_chunks(source, path, segments[0][1].st_size, True, since, until),
+                              encoding)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+        etag += '-' + encoding
+    return content, 'text/plain', filename, headers, etag, last_modified
+
+
 @app.route('/api/logs/download', methods=['GET'])
 def api_download_logs():
+    # Range requests (resumed downloads) get the uncompressed file.
+    encoding = 'identity' if request.range else negotiate_encoding(request.accept_encodings)
     try:
-        return send_file(LOG_FILE, as_attachment=True)
+        content, mimetype, filename, headers, etag, last_modified = log_download_body(request.args, encoding)
+        if isinstance(content, str):
+            response = send_file(os.path.abspath(content), mimetype=mimetype, as_attachment=True,
+                                 download_name=filename, conditional=True)
+            response.vary.add('Accept-Encoding')
+            return response
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = bool(request.if_modified_since and last_modified <= request.if_modified_since)
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = Response(content, mimetype=mimetype, headers=headers)
+            response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error downloading log file: {str(e)}")
         return jsonify({'error': 'Failed to download log file'}), 500
 
 
+def submit_dashboard_job(label, kind, fn, *args, key=None, timeout=None):
+    try:
+        job, created = job_manager.submit(kind, fn, *args, key=key, timeout=timeout)
+        if created:
+            flash(f"{label} started in the background (job {job.id[:8]}).")
+        else:
+            flash(f"{label} is already running (job {job.id[:8]}).")
+    except JobQueueFull as e:
+        flash(f"Cannot start {label.lower()}: {str(e)}")
+
+
 @app.route('/', methods=['GET', 'POST'])
 def dashboard():
     if request.method == 'POST':
@@ -209,479 +4539,51 @@ def dashboard():
                 mac = request.form.get('mac')
                 hostname = request.form.get('hostname')
                 ip = request.form.get('ip') or None
-                hosts = read_dhcp_hosts()
-                if any(h[0] == mac for h in hosts):
-                    flash(f"MAC address {mac} already exists. Edit the existing entry to update.")
-                elif any(h[1] == hostname for h in hosts):
-                    flash(f"Hostname {hostname} already exists. Choose a different hostname.")
-                else:
-                    hosts.append((mac, hostname, ip))
-                    write_dhcp_hosts(hosts)
-                    restart_dnsmasq()
-                    flash("Host added successfully.")
+                error = validate_host(mac, hostname, ip)
+                with host_transaction() as transaction:
+                    store = transaction.store
+                    conflict = store.conflict(mac, hostname, ip) if not error else None
+                    if error:
+                        flash(f"{error}: the host was not added.")
+                    elif conflict == 'mac':
+                        flash(f"MAC address {mac} already exists. Edit the existing entry to update.")
+                    elif conflict == 'hostname':
+                        flash(f"Hostname {hostname} already exists. Choose a different hostname.")
+                    elif conflict == 'ip':
+                        flash(f"IP address {ip} is already reserved by {store.find_by_ip(ip).hostname}.")
+                    else:
+                        host = store.add((normalize_mac(mac), hostname, ip))
+                        save_host_changes(store, added=[host])
+                        schedule_dnsmasq_apply()
+                        flash("Host added successfully.")
             except Exception as e:
                 flash(f"Error adding host: {str(e)}")
                 logging.error(f"Error adding host: {str(e)}")
         elif action == 'restart':
-            try:
-                restart_dnsmasq()
-                flash("DNSMASQ service restarted.")
-            except Exception as e:
-                flash(f"Error restarting DNSMASQ: {str(e)}")
+            submit_dashboard_job("DNSMASQ restart", 'restart', restart_dnsmasq_job, key='dnsmasq-restart',
+                                 timeout=SUBPROCESS_TIMEOUT)
         elif action == 'backup':
-            try:
-                backup_file = backup_dnsmasq_conf()
-                flash(f"Backup created: {backup_file}")
-            except Exception as e:
-                flash(f"Error creating backup: {str(e)}")
+            submit_dashboard_job("Backup", 'backup', backup_job, key='backup', timeout=SUBPROCESS_TIMEOUT)
         elif action == 'status':
-            status = get_dnsmasq_status()
-            flash(f"DNSMASQ Status:\n{status}")
+            flash(format_dnsmasq_status(status_monitor.get()))
         elif action == 'shutdown':
-            return render_template_string('''
-<!DOCTYPE html>
-<html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Confirm Shutdown</title>
-                <style>
-                    body {
-                        font-family: Arial, sans-serif;
-                        margin: 0;
-                        padding: 20px;
-                        background-color: #f5f5f5;
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        min-height: 100vh;
-                    }
-                    .container {
-                        background-color: white;
-                        padding: 30px;
-                        border-radius: 10px;
-                        box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                        max-width: 400px;
-                        width: 100%;
-                    }
-                    h1 {
-                        color: #343f48;
-                        margin-top: 0;
-                        font-size: 24px;
-                    }
-                    .warning {
-                        color: red;
-                        font-weight: bold;
-                        font-size: 18px;
-                    }
-                    p {
-                        font-size: 16px;
-                        line-height: 1.5;
-                    }
-                    input[type="submit"] {
-                        background-color: #343f48;
-                        color: #ffd700;
-                        font-size: 16px;
-                        border: none;
-                        border-radius: 5px;
-                        padding: 12px 20px;
-                        cursor: pointer;
-                        width: 100%;
-                        margin-top: 20px;
-                    }
-                    input[type="submit"]:hover {
-                        background-color: red;
-                        color: yellow;
-                        font-weight: bold;
-                    }
-                    .cancel-link {
-                        display: block;
-                        text-align: center;
-                        margin-top: 20px;
-                        color: #343f48;
-                        text-decoration: none;
-                        font-size: 16px;
-                    }
-                    .cancel-link:hover {
-                        text-decoration: underline;
-                    }
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <h1>Confirm Shutdown</h1>
-                    <p class="warning">Are you sure you want to shut down the Raspberry Pi?</p>
-                    <p>This will terminate all services and you won't be able to access the device remotely until it's manually restarted.</p>
-                    <form method="post">
-                        <input type="hidden" name="action" value="confirm_shutdown">
-                        <input type="submit" value="Yes, Shut Down">
-                    </form>
-                    <a href="{{ url_for('dashboard') }}" class="cancel-link">Cancel</a>
-                </div>
-            </body>
-            </html>
-            ''')
+            return render_template('confirm_shutdown.html')
         elif action == 'confirm_shutdown':
             flash("Shutting down the Raspberry Pi...")
             shutdown_pi()
         elif action == 'wifi':
             ssid = request.form.get('ssid')
             password = request.form.get('password')
-            if update_wifi_settings(ssid, password):
-                flash("Wi-Fi settings updated successfully. The Raspberry Pi has connected to the new network.",
-                      "success")
-            else:
-                flash("Failed to update Wi-Fi settings or connect to the new network.", "error")
-
-    hosts = read_dhcp_hosts()
-    return render_template_string('''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>DHCP/DNS Dashboard</title>
-    <style>
-        html, body {
-            height: 100%;
-            margin: 0;
-            padding: 0;
-            font-family: Arial, sans-serif;
-        }
-        .page-container {
-            display: flex;
-            flex-direction: column;
-            min-height: 100vh;
-        }
-        .content-wrap {
-            flex: 1 0 auto;
-            padding: 20px;
-        }
-        body { font-family: Arial, sans-serif; }
-        input[type="text"] { width: 200px; margin-bottom: 10px; }
-        .flash { padding: 10px; background-color: #f0f0f0; margin-bottom: 20px; white-space: pre-wrap; }
-        .danger { background-color: #ffdddd; color: #f44336; }
-        .form-container {
-            background-color: #f2f2f2;
-            padding: 2rem;
-            border-radius: 8px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            width: 300px;
-        }
-        h2 { color: #333; margin-bottom: 1.5rem; }
-        form { display: flex; flex-direction: column; }
-        label { margin-bottom: 0.5rem; color: #555; }
-        input[type="text"] {
-            padding: 0.5rem;
-            margin-bottom: 1rem;
-            border: 1px solid #ddd;
-            border-radius: 14px;
-        }
-        input[type="submit"] {
-            background-color:#343f48;
-            color: #ffd700;
-            padding: 0.75rem;
-            border: none;
-            border-radius: 10px;
-            cursor: pointer;
-            font-size: 1rem;
-            transition: background-color 0.3s;
-        }
-        input[type="submit"]:hover { background-color: #45a049; }
-        .footer {
-            flex-shrink: 0;
-            background-color: #505e6b;
-            color: #ffffff;
-            text-align: center;
-            padding: 10px;
-            font-size: 20px;
-        }
-        
-        .form-container-wrapper {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(300px, 1fr));
-            gap: 20px;
-            width: 100%;
-            margin-left: 0;
-        }
-
-        .form-container {
-            flex: 1; /* Makes both containers take up equal width */
-            width: auto;
-            background-color: #f2f2f2;
-            padding: 2rem;
-            border-radius: 8px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        }
-        input[type="text"], input[type="password"] {
-            width: 100%;
-            box-sizing: border-box;
-        }
-        .form-container input[type="text"],
-        .form-container input[type="password"],
-        .form-container input[type="submit"] {
-            width: 100%;
-            padding: 0.5rem;
-            margin-bottom: 1rem;
-            border: 1px solid #ddd;
-            border-radius: 4px;
-            box-sizing: border-box;
-        }
-
-        @media (max-width: 650px) {
-            .dhcp-hosts, .form-container-wrapper {
-                grid-template-columns: 1fr;
-            }
-            
-            .host-card, .form-container {
-                max-width: none;
-                width: 100%;
-            }
-        }
-            .responsive-table {
-        width: 100%;
-        margin-bottom: 20px;
-        overflow-x: auto;
-        }
-        .action-buttons {
-            display: flex;
-            gap: 5px;
-        }
-        .action-buttons input[type="submit"] {
-            padding: 5px 10px;
-            font-size: 0.9em;
-        }
-        
-        @media screen and (max-width: 600px) {
-            .responsive-table {
-                overflow-x: scroll;
-            }
-            th, td {
-                padding: 8px;
-            }
-            .action-buttons {
-                flex-direction: column;
-            }
-        }
-        
-        .dhcp-hosts, .form-container-wrapper {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(280px, 1fr));
-            gap: 20px;
-            width: 100%;
-            margin-bottom: 30px;
-        }
-    
-            .host-card, .form-container {
-            background-color: #f2f2f2;
-            border-radius: 8px;
-            padding: 20px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            width: 100%;
-            box-sizing: border-box;
-        }
-    
-    .host-card h3 {
-        margin-top: 0;
-        color: #343f48;
-        border-bottom: 2px solid #ffd700;
-        padding-bottom: 10px;
-        margin-bottom: 15px;
-    }
-    
-    .host-info {
-        margin-bottom: 20px;
-    }
-    
-    .host-info strong {
-        color: #343f48;
-    }
-    
-        .host-actions {
-            display: flex;
-            justify-content: space-between;
-            gap: 10px;
-            margin-top: 15px;
-        }
-        
-        .host-actions form {
-            flex: 1;
-        }
-        
-        .host-actions input[type="submit"] {
-            width: 100%;
-            padding: 10px 15px;
-            border: none;
-            border-radius: 10px;
-            font-size: 16px;
-            font-weight: bold;
-            cursor: pointer;
-            transition: background-color 0.3s ease;
-        }
-        
-        .host-actions input[type="submit"]:hover {
-            opacity: 0.9;
-        }
-        
-        .edit-button {
-            background-color: #343f48;
-            color: #ffd700;
-        }
-        
-        .remove-button {
-            background-color: #e74c3c;
-            color: white;
-        }
-        
-        .host-actions input[type="submit"].remove-button:hover {
-            background-color: #ff0000;
-            color: yellow;
-        }
-    
-    .host-actions input[type="submit"]:hover {
-            background-color: #45a049;
-    
-    @media screen and (max-width: 600px) {
-        .dhcp-hosts {
-            grid-template-columns: 1fr;
-        }
-    }
-    
-    /* Mobile dns management */
-            .management-buttons {
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-                gap: 15px;
-                max-width: 800px;
-                margin: 20px auto;
-            }
-            
-            .management-buttons button {
-                width: 100%;
-                padding: 10px 15px;
-                background-color: #343f48;
-                color: #ffd700;
-                border: none;
-                border-radius: 10px;
-                font-size: 16px;
-                font-weight: bold;
-                cursor: pointer;
-                transition: background-color 0.3s ease;
-            }
-            
-            .management-buttons button:hover {
-                background-color: #45a049;
-                color: yellow;
-            }
-            
-            @media (max-width: 600px) {
-                .management-buttons {
-                    grid-template-columns: 1fr;
-                }
-            }
-    
-    </style>
-</head>
-<body>
-    <div class="page-container">
-        <div class="content-wrap">
-            <h1>DHCP/DNS Dashboard</h1>
-            {% with messages = get_flashed_messages() %}
-                {% if messages %}
-                    {% for message in messages %}
-                        <div class="flash">{{ message }}</div>
-                    {% endfor %}
-                {% endif %}
-            {% endwith %}
-            
-            <h2>Current DHCP Hosts</h2>
-            <div class="dhcp-hosts">
-                {% for mac, hostname, ip in hosts %}
-                <div class="host-card">
-                    <h3>{{ hostname }}</h3>
-                    <div class="host-info">
-                        <p><strong>MAC Address:</strong> {{ mac }}</p>
-                        <p><strong>IP Address:</strong> {{ ip if ip else 'Dynamic' }}</p>
-                    </div>
-                    <div class="host-actions">
-                    <form method="get" action="{{ url_for('edit_host') }}">
-                        <input type="hidden" name="mac" value="{{ mac }}" />
-                        <input type="submit" value="Edit" class="edit-button" />
-                    </form>
-                    <form onsubmit="return confirmRemove('{{ hostname }}')" method="post" action="{{ url_for('remove_host') }}">
-                        <input type="hidden" name="mac" value="{{ mac }}" />
-                        <input type="submit" value="Remove" class="remove-button" />
-                    </form>
-                </div>
-                </div>
-                {% endfor %}
-            </div>
-            <br>
-            <div class="form-container-wrapper">
-                <div class="form-container">
-                    <h2>Add New Host</h2>
-                    <form method="post">
-                        <input type="hidden" name="action" value="add" />
-                        <label for="mac">MAC Address:</label>
-                        <input type="text" id="mac" name="mac" required />
-                        <label for="hostname">Hostname:</label>
-                        <input type="text" id="hostname" name="hostname" required />
-                        <label for="ip">IP Address (optional):</label>
-                        <input type="text" id="ip" name="ip" />
-                        <input type="submit" value="Add Host" />
-                    </form>
-                </div>
-                
-                <div class="form-container">
-                    <h2>Wi-Fi Configuration</h2>
-                    <form method="post">
-                        <input type="hidden" name="action" value="wifi">
-                        <label for="ssid">Wi-Fi SSID:</label>
-                        <input type="text" id="ssid" name="ssid" required>
-                        <label for="password">Wi-Fi Password:</label>
-                        <input type="password" id="password" name="password" required>
-                        <input type="submit" value="Update Wi-Fi Settings">
-                    </form>
-                </div>
-            </div>
-            
-            <h2>DNSMASQ Management</h2>
-            <form method="post" style="display: inline;">
-                <input type="hidden" name="action" value="restart" />
-                <input type="submit" value="Restart DNSMASQ" />
-            </form>
-            <form method="post" style="display: inline; margin-left: 10px;">
-                <input type="hidden" name="action" value="backup" />
-                <input type="submit" value="Backup Configuration" />
-            </form>
-            <form method="post" style="display: inline; margin-left: 10px;">
-                <input type="hidden" name="action" value="status" />
-                <input type="submit" value="Check DNSMASQ Status" />
-            </form>
-                                              
-            <h2>System Management</h2>
-            <form method="post" style="display: inline;">
-                <input type="hidden" name="action" value="shutdown" />
-                <input type="submit" value="Shutdown Raspberry Pi" class="danger" />
-            </form>
-        </div>
-        
-        <footer class="footer">
-            <p>&copy; <span id="current-year"></span> JPHsystems. All rights reserved.</p>
-        </footer>
-
-        <script>
-            document.getElementById('current-year').textContent = new Date().getFullYear();
-                                  
-            function confirmRemove(hostname) {
-                return confirm(`Are you sure you want to remove the host "${hostname}"?`);
-            }
+            submit_dashboard_job("Wi-Fi update", 'wifi', wifi_job, ssid, password, key='wifi', timeout=120)
 
-        </script>
-    </div>
-</body>
-</html>
-    ''', hosts=hosts)
+    q = request.args.get('q', '').strip()
+    per_page = min(max(request.args.get('per_page', default=DASHBOARD_PAGE_SIZE, type=int), 1), 500)
+    hosts = filter_hosts(load_host_store().view(), {'q': q})
+    pages = max((len(hosts) + per_page - 1) // per_page, 1)
+    page = min(max(request.args.get('page', default=1, type=int), 1), pages)
+    return render_template('dashboard.html', hosts=hosts[(page - 1) * per_page:page * per_page],
+                           total=len(hosts), page=page, pages=pages, per_page=per_page, q=q,
+                           jobs=job_manager.list(limit=5))
 
 
 @app.route('/edit', methods=['GET', 'POST'])
@@ -691,143 +4593,452 @@ def edit_host():
         new_mac = request.form.get('new_mac')
         new_hostname = request.form.get('new_hostname')
         new_ip = request.form.get('new_ip') or None
+        # The entry as it was when the form was rendered; if it has changed
+        # since, the edit would silently overwrite someone else's update.
+        shown = (request.form.get('old_hostname'), request.form.get('old_ip', ''))
 
-        hosts = read_dhcp_hosts()
-        updated_hosts = [(new_mac, new_hostname, new_ip) if h[0] == old_mac else h for h in hosts]
+        invalid = False
+        with host_transaction() as transaction:
+            store = transaction.store
+            current = store.get(old_mac)
+            error = validate_host(new_mac, new_hostname, new_ip)
+            conflict = None
+            if not error:
+                new_mac = normalize_mac(new_mac)
+                conflict = store.conflict(new_mac, new_hostname, new_ip, ignore_mac=old_mac)
 
-        if hosts == updated_hosts:
-            flash("No changes were made.")
-        else:
-            write_dhcp_hosts(updated_hosts)
-            restart_dnsmasq()
-            flash("Host updated successfully.")
+            if current is None:
+                flash("Host not found. It may have been removed by someone else.")
+            elif shown[0] is not None and (current.hostname, current.ip) != shown:
+                flash(f"Host {current.hostname} was changed by someone else. Review it and try again.")
+            elif error:
+                flash(f"{error}: the host was not updated.")
+                invalid = True
+            elif current == (new_mac, new_hostname, new_ip or ''):
+                flash("No changes were made.")
+            elif conflict:
+                flash(f"Cannot update host: {CONFLICT_MESSAGES[conflict]}.")
+                invalid = True
+            else:
+                host = store.replace(old_mac, (new_mac, new_hostname, new_ip))
+                save_host_changes(store, added=[host], removed=[current])
+                schedule_dnsmasq_apply()
+                flash("Host updated successfully.")
 
+        if invalid:
+            # Nothing was written; show the form again with what was entered.
+            return render_template('edit_host.html', host=current, entered=(new_mac, new_hostname, new_ip or ''))
         return redirect(url_for('dashboard'))
 
     mac = request.args.get('mac')
-    hosts = read_dhcp_hosts()
-    host = next((h for h in hosts if h[0] == mac), None)
+    host = load_host_store().get(mac) if mac else None
 
     if not host:
         flash("Host not found.")
         return redirect(url_for('dashboard'))
 
-    return render_template_string('''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Edit DHCP Host</title>
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            background-color: #f0f0f0;
-            margin: 0;
-            padding: 0;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            min-height: 100vh;
-        }
-        .container {
-            background-color: white;
-            padding: 2rem;
-            border-radius: 8px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            width: 350px;
-        }
-        h1 {
-            color: #333;
-            margin-bottom: 1.5rem;
-            font-size: 1.5rem;
-        }
-        form {
-            display: flex;
-            flex-direction: column;
-        }
-        label {
-            margin-bottom: 0.5rem;
-            color: #555;
-        }
-        input[type="text"] {
-            padding: 0.5rem;
-            margin-bottom: 1rem;
-            border: 1px solid #ddd;
-            border-radius: 14px;
-            width: 100%;
-            box-sizing: border-box;
-        }
-        input[type="submit"] {
-            background-color: #343f48;
-            color: #ffd700;
-            padding: 0.75rem;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            font-size: 1rem;
-            transition: background-color 0.3s;
-        }
-        input[type="submit"]:hover {
-            background-color: #45a049;
-        }
-        .cancel-link {
-            display: inline-block;
-            margin-top: 1rem;
-            color: #666;
-            text-decoration: none;
-            transition: color 0.3s;
-        }
-        .cancel-link:hover {
-            color: #333;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Edit DHCP Host</h1>
-        <form method="post">
-            <input type="hidden" name="old_mac" value="{{ host[0] }}">
-            
-            <label for="new_mac">MAC Address:</label>
-            <input type="text" id="new_mac" name="new_mac" value="{{ host[0] }}" required>
-            
-            <label for="new_hostname">Hostname:</label>
-            <input type="text" id="new_hostname" name="new_hostname" value="{{ host[1] }}" required>
-            
-            <label for="new_ip">IP Address:</label>
-            <input type="text" id="new_ip" name="new_ip" value="{{ host[2] or '' }}">
-            
-            <input type="submit" value="Update Host">
-        </form>
-        <a href="{{ url_for('dashboard') }}" class="cancel-link">Cancel</a>
-    </div>
-</body>
-</html>
-    ''', host=host)
+    return render_template('edit_host.html', host=host)
 
 
 @app.route('/remove', methods=['POST'])
 def remove_host():
     try:
         mac = request.form.get('mac')
-        hosts = read_dhcp_hosts()
-        original_count = len(hosts)
-        hosts = [h for h in hosts if h[0] != mac]
-        if len(hosts) == original_count:
-            flash(f"No host found with MAC address {mac}")
-            logging.warning(f"Attempted to remove non-existent host with MAC {mac}")
-        else:
-            write_dhcp_hosts(hosts)
-            restart_dnsmasq()
-            flash("Host removed successfully.")
-            logging.info(f"Removed host with MAC {mac}")
+        with host_transaction() as transaction:
+            store = transaction.store
+            host = store.remove(mac)
+            if host is None:
+                flash(f"No host found with MAC address {mac}")
+                logging.warning(f"Attempted to remove non-existent host with MAC {mac}")
+            else:
+                save_host_changes(store, removed=[host])
+                schedule_dnsmasq_apply()
+                flash("Host removed successfully.")
+                logging.info(f"Removed host with MAC {mac}")
     except Exception as e:
         flash(f"Error removing host: {str(e)}")
         logging.error(f"Error removing host: {str(e)}")
     return redirect(url_for('dashboard'))
 
 
+ASYNC_MAX_BODY = 64 * 1024 * 1024
+
+
+class AsyncApi:
+    # aiohttp versions of the host, log and status endpoints. They call the
+    # same host store, transaction and log helpers as the Flask views, with
+    # blocking file work on a small thread pool, so one process can hold
+    # hundreds of slow clients (log streams and downloads) on one core.
+    # Every other URL, including the web pages, is passed to the Flask app.
+    def __init__(self, threads):
+        from aiohttp import web
+        from werkzeug.datastructures import MultiDict
+        from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags, quote_etag
+        self.web = web
+        self.MultiDict = MultiDict
+        self.http_date = http_date
+        self.parse_accept_header = parse_accept_header
+        self.parse_date = parse_date
+        self.parse_etags = parse_etags
+        self.quote_etag = quote_etag
+        self.threads = threads
+
+    def application(self):
+        web = self.web
+        application = web.Application(middlewares=[self.record_request], client_max_size=ASYNC_MAX_BODY)
+        application.on_startup.append(self.start_executor)
+        application.router.add_get('/api/hosts', self.get_hosts)
+        application.router.add_post('/api/hosts', self.add_host)
+        application.router.add_delete('/api/hosts/{mac}', self.remove_host)
+        application.router.add_get('/api/logs', self.get_logs)
+        application.router.add_get('/api/logs/stream', self.stream_logs)
+        application.router.add_get('/api/logs/search', self.search_logs)
+        application.router.add_get('/api/logs/download', self.download_logs)
+        application.router.add_get('/api/status', self.status)
+        application.router.add_route('*', '/{path:.*}', self.wsgi)
+        return application
+
+    async def start_executor(self, application):
+        # asyncio.to_thread runs on the default executor; bound it like the
+        # threads of a gunicorn worker.
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='async-io'))
+
+    @property
+    def record_request(self):
+        # Request metrics and the debug log line, as log_request does for Flask.
+        @self.web.middleware
+        async def middleware(request, handler):
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status
+                return response
+            except self.web.HTTPException as e:
+                status = e.status
+                raise
+            finally:
+                latency = (time.perf_counter() - started) * 1000
+                resource = request.match_info.route.resource
+                route = resource.canonical if resource is not None and handler != self.wsgi else None
+                if route is not None:
+                    labels = (('route', route), ('method', request.method))
+                    metrics.observe('dhcp_dashboard_http_request_duration_seconds', latency / 1000, labels)
+                    metrics.inc('dhcp_dashboard_http_requests_total', labels + (('status', status),))
+                    logging.debug(f"{request.method} {request.path} {status} {latency:.1f}ms",
+                                  extra={'route': route, 'method': request.method, 'status': status,
+                                         'mac': request.match_info.get('mac'), 'latency_ms': round(latency, 3)})
+        return middleware
+
+    def json(self, body, status=200, etag=None):
+        response = self.web.json_response(body, status=status)
+        if etag:
+            response.headers['ETag'] = self.quote_etag(etag)
+        return response
+
+    def if_match(self, request):
+        header = request.headers.get('If-Match')
+        return self.parse_etags(header) if header is not None else None
+
+    async def get_hosts(self, request):
+        store, signature = await asyncio.to_thread(load_host_snapshot)
+        etag = hosts_etag(signature, request.rel_url.raw_query_string.encode())
+        last_modified = hosts_last_modified(signature)
+        headers = {'Cache-Control': 'no-cache'}
+        if last_modified:
+            headers['Last-Modified'] = self.http_date(last_modified)
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            matched = matching_etag(self.parse_etags(if_none_match), etag)
+        else:
+            since = self.parse_date(request.headers.get('If-Modified-Since'))
+            matched = etag if last_modified and since and last_modified <= since else None
+        if matched:
+            headers['ETag'] = self.quote_etag(matched)
+            return self.web.Response(status=304, headers=headers)
+
+        encoding = negotiate_encoding(self.parse_accept_header(request.headers.get('Accept-Encoding')))
+        try:
+            content, mimetype, body_headers = await asyncio.to_thread(host_list_body, store, etag,
+                                                                      self.MultiDict(request.query), encoding)
+        except ValueError as e:
+            return self.json({'error': str(e)}, 400)
+        headers.update(body_headers)
+        headers['ETag'] = self.quote_etag(coded_etag(etag, body_headers.get('Content-Encoding', 'identity')))
+        headers['Content-Type'] = mimetype
+        if isinstance(content, bytes):
+            return self.web.Response(body=content, headers=headers)
+        # NDJSON chunks are serialized on the thread pool as they are sent.
+        response = self.web.StreamResponse(headers=headers)
+        await response.prepare(request)
+        while True:
+            chunk = await asyncio.to_thread(next, content, None)
+            if chunk is None:
+                break
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def add_host(self, request):
+        try:
+            data = await request.json()
+        except ValueError:
+            return self.json({'error': 'Invalid JSON'}, 400)
+        return self.json(*await asyncio.to_thread(add_host_from_api, data, self.if_match(request)))
+
+    async def remove_host(self, request):
+        return self.json(*await asyncio.to_thread(remove_host_from_api, request.match_info['mac'],
+                                                  self.if_match(request)))
+
+    async def get_logs(self, request):
+        try:
+            lines = int(request.query.get('lines', 50))
+            after = int(request.query['after']) if 'after' in request.query else None
+        except ValueError:
+            lines, after = 50, None
+        if lines < 1:
+            return self.json({'error': 'lines must be at least 1'}, 400)
+        try:
+            if after is not None:
+                logs, offset = await asyncio.to_thread(read_log_lines_after, LOG_FILE, max(after, 0), lines)
+            else:
+                logs, offset = await asyncio.to_thread(tail_log_segments, LOG_FILE, lines)
+        except Exception as e:
+            logging.error(f"Error reading log file: {str(e)}")
+            return self.json({'error': 'Failed to read log file'}, 500)
+        return self.json({'logs': logs, 'offset': offset})
+
+    async def search_logs(self, request):
+        return self.json(*await asyncio.to_thread(search_logs_from_api, request.query))
+
+    async def stream_logs(self, request):
+        sources = log_sources()
+        source = request.query.get('source', 'dashboard')
+        if source not in sources:
+            return self.json({'error': 'Unknown log source'}, 400)
+        path = sources[source]
+        try:
+            backlog = int(request.query.get('lines', 0))
+        except ValueError:
+            backlog = 0
+
+        response = self.web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                                    'X-Accel-Buffering': 'no'})
+        await response.prepare(request)
+        follower = get_log_follower(path)
+        subscription = follower.subscribe(AsyncLogSubscription(asyncio.get_running_loop(), LOG_STREAM_QUEUE_SIZE))
+        try:
+            await response.write(b'retry: 3000\n\n')
+            if backlog > 0:
+                try:
+                    lines, _ = await asyncio.to_thread(tail_log_lines, path, backlog)
+                    await response.write(sse(lines).encode())
+                except OSError:
+                    pass
+            while True:
+                lines, dropped = await subscription.get(LOG_STREAM_HEARTBEAT)
+                if lines:
+                    await response.write(sse(lines).encode())
+                if dropped:
+                    await response.write(f'event: dropped\ndata: {dropped}\n\n'.encode())
+                if not lines and not dropped:
+                    await response.write(b': keepalive\n\n')
+        except ConnectionResetError:
+            pass
+        finally:
+            follower.unsubscribe(subscription)
+        return response
+
+    async def download_logs(self, request):
+        if request.headers.get('Range'):
+            encoding = 'identity'
+        else:
+            encoding = negotiate_encoding(self.parse_accept_header(request.headers.get('Accept-Encoding')))
+        try:
+            content, mimetype, filename, headers, etag, last_modified = await asyncio.to_thread(
+                log_download_body, self.MultiDict(request.query), encoding)
+        except ValueError as e:
+            return self.json({'error': str(e)}, 400)
+        except Exception as e:
+            logging.error(f"Error downloading log file: {str(e)}")
+            return self.json({'error': 'Failed to download log file'}, 500)
+        if isinstance(content, str):
+            # FileResponse sends the file from the thread pool (or with
+            # sendfile) and handles Range and conditional requests itself.
+            headers.update({'Content-Type': mimetype, 'Content-Disposition': f'attachment; filename={filename}'})
+            return self.web.FileResponse(content, headers=headers)
+        validators = {'ETag': self.quote_etag(etag), 'Last-Modified': self.http_date(last_modified),
+                      'Vary': headers['Vary']}
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            not_modified = self.parse_etags(if_none_match).contains(etag)
+        else:
+            since = self.parse_date(request.headers.get('If-Modified-Since'))
+            not_modified = bool(since and last_modified <= since)
+        if not_modified:
+            return self.web.Response(status=304, headers=validators)
+        headers.update(validators)
+        headers.update({'Content-Type': mimetype, 'Content-Disposition': f'attachment; filename={filename}'})
+        # Chunks are read and compressed on the thread pool as they are sent.
+        response = self.web.StreamResponse(headers=headers)
+        await response.prepare(request)
+        while True:
+            chunk = await asyncio.to_thread(next, content, None)
+            if chunk is None:
+                break
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def status(self, request):
+        status = status_monitor.get()
+        status.pop('checked_at', None)
+        status['reload'] = reload_scheduler.status()
+        return self.json(status, 200 if status['active_state'] == 'active' else 503)
+
+    async def wsgi(self, request):
+        # Runs the Flask app on the thread pool. Each request gets its own
+        # contextvars context, so a streamed Flask response keeps its request
+        # context while its chunks are produced on different threads.
+        body = await request.read()
+        path, _, query = request.rel_url.raw_path_qs.partition('?')
+        host, _, port = (request.host or '').partition(':')
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.parse.unquote(path, encoding='latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': host or 'localhost',
+            'SERVER_PORT': port or ('443' if request.secure else '80'),
+            'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+            'REMOTE_ADDR': request.remote or '',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': request.scheme,
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if 'Content-Type' in request.headers:
+            environ['CONTENT_TYPE'] = request.headers['Content-Type']
+        for name, value in request.headers.items():
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        iterable = await loop.run_in_executor(None, context.run, app, environ, start_response)
+        try:
+            status, _, reason = started['status'].partition(' ')
+            response = self.web.StreamResponse(status=int(status), reason=reason)
+            for name, value in started['headers']:
+                response.headers.add(name, value)
+            await response.prepare(request)
+            chunks = iter(iterable)
+            while True:
+                chunk = await loop.run_in_executor(None, context.run, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await response.write(chunk)
+            await response.write_eof()
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close:
+                await loop.run_in_executor(None, context.run, close)
+        return response
+
+
+def run_aiohttp(bind, threads):
+    from aiohttp import web
+    host, _, port = bind.rpartition(':')
+    web.run_app(AsyncApi(threads).application(), host=host or '0.0.0.0', port=int(port), print=None,
+                access_log=None)
+
+
+def run_gunicorn(bind, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class DashboardApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            # Workers import nothing from the master's request state; every
+            # shared structure revalidates against files on disk.
+            self.cfg.set('preload_app', False)
+            self.cfg.set('timeout', 120)
+            self.cfg.set('graceful_timeout', 30)
+
+        def load(self):
+            return app
+
+    DashboardApplication().run()
+
+
+def run_waitress(bind, threads):
+    import waitress
+    waitress.serve(app, listen=bind, threads=threads)
+
+
+def serve(bind='0.0.0.0:8080', workers=2, threads=4, server='auto'):
+    if server == 'aiohttp':
+        # Single process: the asyncio API serves many connections itself.
+        logging.info("Serving with aiohttp in a single process")
+        return run_aiohttp(bind, workers * threads)
+    if server in ('auto', 'gunicorn'):
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            if server == 'gunicorn':
+                raise
+        else:
+            return run_gunicorn(bind, workers, threads)
+    if server in ('auto', 'waitress'):
+        try:
+            import waitress  # noqa: F401
+        except ImportError:
+            if server == 'waitress':
+                raise
+        else:
+            logging.info("Serving with waitress in a single process")
+            return run_waitress(bind, workers * threads)
+    logging.warning("No production server installed, serving with the threaded Werkzeug server")
+    host, _, port = bind.rpartition(':')
+    app.run(host=host or '0.0.0.0', port=int(port), threaded=True, debug=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='DHCP/DNS dashboard for dnsmasq')
+    parser.add_argument('command', nargs='?', default='serve', choices=['serve'])
+    parser.add_argument('--bind', default=os.environ.get('DHCP_DASHBOARD_BIND', '0.0.0.0:8080'),
+                        help='address:port to listen on')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('DHCP_DASHBOARD_WORKERS', 2)),
+                        help='worker processes (gunicorn)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('DHCP_DASHBOARD_THREADS', 4)),
+                        help='threads per worker')
+    parser.add_argument('--server', default='auto', choices=['auto', 'gunicorn', 'waitress', 'werkzeug', 'aiohttp'])
+    parser.add_argument('--debug', action='store_true', help='run the Flask development server with the reloader')
+    args = parser.parse_args(argv)
+
+    if args.debug:
+        host, _, port = args.bind.rpartition(':')
+        app.run(host=host or '0.0.0.0', port=int(port), debug=True)
+    else:
+        serve(args.bind, args.workers, args.threads, args.server)
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
-    app.config['FORCE_JSON'] = True
+    main()